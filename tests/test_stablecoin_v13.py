@@ -0,0 +1,504 @@
+import glob
+import importlib.util
+import json
+import os
+import time
+import uuid
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("binance")
+from binance.error import ClientError  # noqa: E402
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "红树林湖-稳定币-源码")
+
+
+def load_source(filename, module_name, workdir):
+    # 在临时目录中导入，运行中写入的订单日志等文件不落在仓库里
+    path = glob.glob(os.path.join(SOURCE_DIR, filename))[0]
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+@pytest.fixture(scope="module")
+def hsl(tmp_path_factory):
+    return load_source("红树林稳定币v1.3.py", "hsl_v13", tmp_path_factory.mktemp("v13"))
+
+
+
+def test_import_does_not_configure_logging(hsl, tmp_path, monkeypatch):
+    load_source("红树林稳定币v1.3.py", "hsl_v13_import", tmp_path)
+    assert not (tmp_path / 'bot.log').exists()
+    root = hsl.logging.getLogger()
+    monkeypatch.setattr(root, 'handlers', [])  # 测试结束后恢复 pytest 自己的日志处理器
+    monkeypatch.setattr(root, 'level', root.level)
+    hsl.configure_logging({'log_file': str(tmp_path / 'run.log')})
+    hsl.logging.info("hello")
+    root.handlers[0].close()
+    assert 'hello' in (tmp_path / 'run.log').read_text(encoding='utf-8')
+
+@pytest.fixture
+def account(hsl, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    acct = hsl.Account("test")
+    acct.client = None
+    return acct
+
+
+@pytest.fixture
+def dai_usdt(hsl, monkeypatch):
+    info = hsl.ExchangeMetadata.parse({
+        'symbol': 'DAIUSDT', 'baseAsset': 'DAI', 'quoteAsset': 'USDT',
+        'filters': [{'filterType': 'LOT_SIZE', 'stepSize': '0.01', 'minQty': '1', 'maxQty': '0'},
+                    {'filterType': 'PRICE_FILTER', 'tickSize': '0.0001'}],
+    })
+    monkeypatch.setitem(hsl.exchange_metadata.symbols, 'DAIUSDT', info)
+    monkeypatch.setattr(hsl.exchange_metadata, 'loaded_at', time.time())
+    return info
+
+
+
+def test_metadata_only_refreshes_loaded_at_on_a_full_reload(hsl, monkeypatch):
+    calls = []
+
+    class Spot:
+        def exchange_info(self, symbols=None, priority=None):
+            calls.append(symbols)
+            names = symbols or ['DAIUSDT', 'FDUSDUSDT']
+            return {'symbols': [{'symbol': name, 'filters': []} for name in names]}
+
+    monkeypatch.setattr(hsl, 'client', Spot())
+    metadata = hsl.ExchangeMetadata(ttl=60)
+    metadata.ensure(['DAIUSDT'])
+    loaded_at = metadata.loaded_at
+    assert calls == [['DAIUSDT']] and loaded_at
+    metadata.ensure(['FDUSDUSDT'])  # 未过期：只补未知的交易对，不刷新 loaded_at
+    assert calls[-1] == ['FDUSDUSDT'] and metadata.loaded_at == loaded_at
+    metadata.loaded_at -= 120
+    metadata.ensure(['DAIUSDT'])  # 过期：重新加载全部已缓存的交易对
+    assert calls[-1] == ['DAIUSDT', 'FDUSDUSDT'] and metadata.loaded_at > loaded_at
+    metadata.load()
+    metadata.loaded_at -= 120
+    metadata.ensure(['DAIUSDT'])  # 已全量加载：过期后全量刷新
+    assert calls[-1] is None and time.time() - metadata.loaded_at < 60
+
+# 本地推送桩：替代 SpotWebsocketStreamClient，记录订阅并把推送交给回调
+class LocalStream:
+    def __init__(self, stream_url, on_message, on_open, on_close, on_error, is_combined):
+        self.stream_url = stream_url
+        self.on_message = on_message
+        self.on_close = on_close
+        self.subscriptions = []
+        self.stopped = False
+
+    def kline(self, symbol, interval):
+        self.subscriptions.append(f"{symbol}@kline_{interval}")
+
+    def user_data(self, listen_key):
+        self.subscriptions.append(listen_key)
+
+    def push(self, stream, data):
+        self.on_message(self, json.dumps({'stream': stream, 'data': data}))
+
+    def stop(self):
+        self.stopped = True
+        self.on_close(self)
+
+
+def kline_event(symbol, open_time, close, closed):
+    return {'e': 'kline', 's': symbol, 'k': {'t': open_time, 'i': '1m', 'o': '1.0', 'h': '1.002', 'l': '0.998',
+                                            'c': str(close), 'v': '10', 'x': closed}}
+
+
+# 只有单一路径经过 USDT 的四个交易对，盘口固定
+class FixedRouter:
+    def __new__(cls, hsl):
+        class Router(hsl.ConversionRouter):
+            def build(self):
+                graph = {coin: [] for coin in self.coins}
+                for coin in ['DAI', 'TUSD', 'FDUSD', 'USDC']:
+                    graph[coin].append(('USDT', f"{coin}/USDT", 'SELL'))
+                    graph['USDT'].append((coin, f"{coin}/USDT", 'BUY'))
+                return graph
+
+            def quotes(self, pairs):
+                return {pair: (0.9999, 1.0001) for pair in pairs}
+        return Router()
+
+
+def test_rolling_ma_matches_window_mean(hsl):
+    closes = np.linspace(0.99, 1.01, 250)
+    rolling = hsl.RollingMA(30)
+    for i, close in enumerate(closes):
+        rolling.push(close, i)
+    assert rolling.mean() == pytest.approx(closes[-30:].mean())
+    assert rolling.last_open_time == 249
+    rolling.set_period(120)
+    assert rolling.mean() is None  # 扩容后只保留了 MA_CAPACITY 个收盘价
+    more = np.linspace(1.0, 1.002, 20)
+    for close in more:
+        rolling.push(close)
+    assert rolling.mean() == pytest.approx(np.concatenate([closes[-100:], more]).mean())
+    rolling.set_period(10)
+    assert rolling.mean() == pytest.approx(more[-10:].mean())
+
+
+def test_rolling_ma_needs_full_window(hsl):
+    rolling = hsl.RollingMA(5)
+    for close in (1.0, 1.0, 1.0, 1.0):
+        rolling.push(close)
+    assert rolling.mean() is None
+    rolling.push(1.5)
+    assert rolling.mean() == pytest.approx(1.1)
+
+
+def test_candle_aggregator_builds_higher_interval(hsl):
+    aggregator = hsl.CandleAggregator('1m', ['5m'])
+    start = 1_700_000_100_000 - 1_700_000_100_000 % 300_000
+    finished = []
+    for i in range(5):
+        kline = [start + i * 60_000, '1.0', str(1.0 + i / 1000), str(1.0 - i / 1000), str(1.0 + i / 10000), '2']
+        finished += aggregator.add('DAI/USDT', kline)
+    assert len(finished) == 1
+    interval, candle = finished[0]
+    assert interval == '5m'
+    assert candle[0] == start
+    assert candle[2] == pytest.approx(1.004) and candle[3] == pytest.approx(0.996)
+    assert candle[4] == pytest.approx(1.0004) and candle[5] == pytest.approx(10)
+
+
+def test_candle_aggregator_drops_incomplete_candle(hsl):
+    aggregator = hsl.CandleAggregator('1m', ['5m'])
+    start = 1_700_000_100_000 - 1_700_000_100_000 % 300_000
+    finished = []
+    for i in (1, 2, 4):  # 中途启动且漏掉一根
+        finished += aggregator.add('DAI/USDT', [start + i * 60_000, '1', '1', '1', '1', '1'])
+    assert finished == []
+
+
+def test_kline_stream_with_local_stand_in(hsl, monkeypatch):
+    monkeypatch.setattr(hsl, 'kline_cache', hsl.KlineCache())
+    stream = hsl.KlineStream(['DAI/USDT'], stream_url='ws://127.0.0.1:9443', ws_factory=LocalStream)
+    monkeypatch.setattr(stream, 'seed', lambda: None)
+    stream.start()
+    ws = stream.ws_client
+    assert ws.stream_url == 'ws://127.0.0.1:9443'
+    assert ws.subscriptions == ['daiusdt@kline_1m']
+    start = 1_700_000_100_000 - 1_700_000_100_000 % 300_000
+    for i in range(5):
+        ws.push('daiusdt@kline_1m', kline_event('DAIUSDT', start + i * 60_000, 1.0 + i / 10000, True))
+    ws.push('daiusdt@kline_1m', kline_event('DAIUSDT', start + 300_000, 1.0009, False))
+    assert stream.live['DAI/USDT'][1] == pytest.approx(1.0009)
+    assert hsl.kline_cache.count('DAI/USDT', '1m') == 5
+    assert hsl.kline_cache.closed('DAI/USDT', '5m', 1) == ([start], [pytest.approx(1.0004)])
+    stream.stop()
+    assert ws.stopped and not stream.connected
+
+
+def test_mid_bucket_start_backfills_gap_over_rest(hsl, tmp_path, monkeypatch):
+    store = hsl.KlineStore(str(tmp_path))
+    monkeypatch.setattr(hsl, 'kline_cache', hsl.KlineCache(store=store))
+    step = hsl.INTERVAL_MS['5m']
+    now = int(time.time() * 1000)
+    start = now - now % step - 2 * step  # start 和 start + step 两根 5m 已收盘
+    hsl.kline_cache.replace('DAI/USDT', '5m', [[start - 2 * step, '1', '1', '1', '1', '1'],
+                                              [start - step, '1', '1', '1', '1', '1']])
+    stream = hsl.KlineStream(['DAI/USDT'], ws_factory=LocalStream)
+    monkeypatch.setattr(stream, 'seed', lambda: None)
+    stream.start()
+    for i in range(2, 10):  # 在 start 这根 5m 中途连上
+        stream.ws_client.push('daiusdt@kline_1m', kline_event('DAIUSDT', start + i * 60_000, 1.0, True))
+    assert hsl.kline_cache.closed('DAI/USDT', '5m', 5)[0] == [start - 2 * step, start - step]
+    assert not hsl.kline_cache.is_current('DAI/USDT', '5m', 2)
+    requests = []
+
+    class Spot:
+        def klines(self, **params):
+            requests.append(params)
+            return [[t, '1', '1', '1', '1.001', '1'] for t in range(params['startTime'], now, step)]
+
+    monkeypatch.setattr(hsl, 'client', Spot())
+    assert hsl.kline_cache.sync('DAI/USDT', '5m', 2) == pytest.approx(1.001)
+    assert requests[0]['startTime'] == start
+    expected = [start - 2 * step, start - step, start, start + step]
+    assert hsl.kline_cache.closed('DAI/USDT', '5m', 5)[0] == expected
+    assert hsl.kline_cache.is_current('DAI/USDT', '5m', 2)
+    assert store.load('DAI/USDT', '5m')['open_time'].tolist() == expected
+
+
+def test_user_data_stream_with_local_stand_in(hsl, account, dai_usdt):
+    class Spot:
+        def new_listen_key(self):
+            return {'listenKey': 'local-key'}
+
+        def account(self, priority=None):
+            return {'balances': [{'asset': 'USDT', 'free': '100'}, {'asset': 'DAI', 'free': '50'}]}
+
+    account.client = Spot()
+    reports = []
+    stream = hsl.UserDataStream(account, stream_url='ws://127.0.0.1:9443', ws_factory=LocalStream)
+    stream.order_handlers.append(reports.append)
+    stream.start()
+    ws = stream.ws_client
+    assert ws.subscriptions == ['local-key']
+    assert account.ledger.state.free['USDT'] == 100.0
+    ws.push('local-key', {'e': 'outboundAccountPosition', 'u': 5, 'B': [{'a': 'USDT', 'f': '80.5'}]})
+    assert account.ledger.state.free['USDT'] == 80.5 and account.ledger.pushed_at == 5
+    ws.push('local-key', {'e': 'executionReport', 'c': 'cid', 'X': 'NEW'})
+    assert reports == [{'e': 'executionReport', 'c': 'cid', 'X': 'NEW'}]
+    ws.push('local-key', {'e': 'listenKeyExpired'})
+    assert not stream.connected
+
+
+def test_rest_market_data_uses_one_ticker_call_and_incremental_klines(hsl, monkeypatch):
+    monkeypatch.setattr(hsl, 'kline_cache', hsl.KlineCache())
+    monkeypatch.setattr(hsl, 'ma_buffers', {})
+    monkeypatch.setattr(hsl, 'kline_stream', None)
+    monkeypatch.setattr(hsl, 'price_bus', None)
+    monkeypatch.setattr(hsl, 'kline_interval', '4h')
+    monkeypatch.setattr(hsl, 'ma_period', 30)
+    step = hsl.INTERVAL_MS['4h']
+    now = int(time.time() * 1000)
+    calls = []
+
+    class Spot:
+        def ticker_price(self, symbols):
+            calls.append(('ticker_price', sorted(symbols)))
+            return [{'symbol': symbol, 'price': '1.0002'} for symbol in symbols]
+
+        def klines(self, symbol, interval, limit=None, startTime=None):
+            calls.append(('klines', symbol, startTime))
+            first = startTime or now - now % step - hsl.MA_CAPACITY * step
+            return [[t, '1', '1', '1', '1.0001', '1'] for t in range(first, now, step)]
+
+    monkeypatch.setattr(hsl, 'client', Spot())
+    pairs = ['DAI/USDT', 'FDUSD/USDT']
+    data = hsl.fetch_market_data(pairs)
+    assert data == {pair: (pytest.approx(1.0002), pytest.approx(1.0001)) for pair in pairs}
+    assert calls[0] == ('ticker_price', ['DAIUSDT', 'FDUSDUSDT'])
+    assert sorted(call[1] for call in calls[1:]) == ['DAIUSDT', 'FDUSDUSDT']
+    calls.clear()
+    hsl.fetch_market_data(pairs)  # 缓存已是最新：只取价格，不再请求K线
+    assert calls == [('ticker_price', ['DAIUSDT', 'FDUSDUSDT'])]
+
+
+def test_transport_fills_supply_and_demand(hsl):
+    cost = np.array([[0.001, 0.003], [0.002, 0.001]])
+    allocations = hsl.RebalancePlanner.transport(cost, np.array([60.0, 40.0]), np.array([50.0, 50.0]), 5)
+    assert len(allocations) <= 3
+    shipped = np.zeros((2, 2))
+    for i, j, amount in allocations:
+        shipped[i, j] += amount
+    assert shipped.sum(axis=1) == pytest.approx([60, 40])
+    assert shipped.sum(axis=0) == pytest.approx([50, 50])
+
+
+def test_planner_nets_flows_through_usdt(hsl, account):
+    account.trade_speed = 0.1
+    account.ledger.state = account.ledger.state.replace(free={**account.ledger.state.free, 'DAI': 1000.0, 'USDT': 1000.0})
+    planner = hsl.RebalancePlanner(FixedRouter(hsl))
+    prices = {f"{coin}/USDT": 1.0 for coin in ['DAI', 'TUSD', 'FDUSD', 'USDC']}
+    orders = planner.plan(account, ['DAI'], ['TUSD', 'FDUSD', 'USDC'], prices)
+    legs = [hop[2:] for _, _, _, (path, _), _ in orders for hop in path]
+    assert sorted(legs) == sorted([('DAI/USDT', 'SELL'), ('TUSD/USDT', 'BUY'), ('FDUSD/USDT', 'BUY'),
+                                   ('USDC/USDT', 'BUY')])
+    waves = hsl.OrderDispatcher.waves(orders)
+    assert [(order[0], order[1]) for order in waves[0]] == [('DAI', 'USDT')]
+    assert all(order[0] == 'USDT' for wave in waves[1:] for order in wave)
+
+
+def test_price_bus_seqlock_survives_publisher_restart(hsl):
+    name = f"hsl_test_{uuid.uuid4().hex[:8]}"
+    writer = hsl.PriceBus(name, writer=True)
+    reader = hsl.PriceBus(name)
+    try:
+        writer.publish({'DAI/USDT': (0.998, 0.999), 'FDUSD/USDT': (1.001, 1.0)}, '4h', 30)
+        assert reader.read(['DAI/USDT', 'FDUSD/USDT'], '4h', 30) == {'DAI/USDT': (0.998, 0.999),
+                                                                     'FDUSD/USDT': (1.001, 1.0)}
+        assert reader.read(['DAI/USDT'], '1h', 30) == {}
+        restarted = hsl.PriceBus(name, writer=True)  # 复用内存块，按新顺序分配下标
+        restarted.publish({'FDUSD/USDT': (1.002, 1.0), 'DAI/USDT': (0.997, 0.999)}, '4h', 30)
+        assert reader.read(['DAI/USDT', 'FDUSD/USDT'], '4h', 30) == {'DAI/USDT': (0.997, 0.999),
+                                                                     'FDUSD/USDT': (1.002, 1.0)}
+        writer.header['seq'] += 1  # 写入中途：读取方重试用尽后按交易对沿用上次的完整数据
+        assert reader.read(['DAI/USDT', 'USDC/USDT'], '4h', 30) == {'DAI/USDT': (0.997, 0.999)}
+        writer.header['seq'] += 1
+        writer.header['layout'] += 1  # 发布方换成其他布局版本
+        assert reader.read(['DAI/USDT'], '4h', 30) == {}
+        with pytest.raises(hsl.PriceBusLayoutError):
+            hsl.PriceBus(name)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_ledger_skips_maker_fills_already_pushed(hsl, account, dai_usdt):
+    ledger = account.ledger
+    ledger.state = ledger.state.replace(free={**ledger.state.free, 'DAI': 100.0})
+    executor = account.maker_executor
+    executor.track('m1')
+    for report in ({'c': 'm1', 'x': 'TRADE', 'X': 'PARTIALLY_FILLED', 'z': '30', 'Z': '29.97', 'n': '0', 'N': 'USDT', 'T': 1000},
+                   {'c': 'm1', 'x': 'TRADE', 'X': 'FILLED', 'z': '50', 'Z': '49.95', 'n': '0.05', 'N': 'USDT', 'T': 1010}):
+        executor.on_execution_report(report)
+    assert executor.stream_state('m1')['transactTime'] == 1010
+    ledger.observe([{'a': 'DAI', 'f': '50'}, {'a': 'USDT', 'f': '49.9'}], 1010)
+    qty, quote, fills, fill_time = executor.collect({'clientOrderId': 'm1', 'transactTime': 990},
+                                                    {'executedQty': '50', 'cummulativeQuoteQty': '49.95'})
+    merged = {'symbol': 'DAIUSDT', 'side': 'SELL', 'orderId': 1, 'transactTime': fill_time,
+              'executedQty': f"{qty}", 'cummulativeQuoteQty': f"{quote}", 'fills': fills}
+    assert not ledger.apply_order(merged)
+    assert ledger.state.free['DAI'] == 50.0 and ledger.state.free['USDT'] == 49.9
+
+
+def test_maker_raises_on_non_crossing_rejection(hsl, account, dai_usdt, monkeypatch):
+    calls = []
+
+    class Spot:
+        def new_order(self, **params):
+            calls.append(params)
+            raise ClientError(400, -2010, 'Account has insufficient balance for requested action.', {})
+
+    account.client = Spot()
+    monkeypatch.setattr(hsl.conversion_router, 'quotes', lambda pairs: {pair: (0.9999, 1.0001) for pair in pairs})
+    with pytest.raises(ClientError):
+        account.maker_executor.execute('DAI/USDT', 'sell', quantity=100)
+    assert len(calls) == 1
+
+
+def test_maker_caps_reposts_then_falls_back(hsl, account, dai_usdt, monkeypatch):
+    calls = []
+
+    class Spot:
+        def new_order(self, **params):
+            calls.append(params)
+            raise ClientError(400, -2010, 'Order would immediately match and take.', {})
+
+    account.client = Spot()
+    monkeypatch.setattr(hsl, 'MAKER_REPOST_BACKOFF', 0)
+    account.maker_max_reposts = 3
+    monkeypatch.setattr(hsl.conversion_router, 'quotes', lambda pairs: {pair: (0.9999, 1.0001) for pair in pairs})
+    monkeypatch.setattr(hsl, 'place_order', lambda acct, pair, side, **size: {
+        'orderId': 7, 'executedQty': '100', 'cummulativeQuoteQty': '99.99', 'fills': [], 'transactTime': 123})
+    result = account.maker_executor.execute('DAI/USDT', 'sell', quantity=100)
+    assert len(calls) == 4
+    assert result['orderId'] == 7 and result['transactTime'] == 123
+    assert account.maker_executor.stats['fallbacks'] == 1 and not account.maker_executor.events
+
+
+def test_maker_drops_reports_for_untracked_orders(hsl, account):
+    executor = account.maker_executor
+    executor.track('m1')
+    executor.on_execution_report({'c': 'm1', 'x': 'NEW', 'X': 'NEW', 'z': '0', 'Z': '0'})
+    executor.collect({'clientOrderId': 'm1'}, {'executedQty': '0', 'cummulativeQuoteQty': '0'})
+    executor.on_execution_report({'c': 'm1', 'x': 'CANCELED', 'X': 'CANCELED', 'z': '0', 'Z': '0'})  # 汇总后迟到
+    executor.on_execution_report({'c': 'other', 'x': 'NEW', 'X': 'NEW', 'z': '0', 'Z': '0'})
+    assert executor.reports == {} and executor.events == {}
+
+
+def test_journal_recover_resolves_in_flight_orders(hsl, account):
+    class Spot:
+        def get_order(self, symbol, origClientOrderId):
+            raise ClientError(400, -2013, 'Order does not exist.', {})
+
+    account.client = Spot()
+    journal = account.journal
+    swap_id = journal.begin_swap([('DAI', 'USDT', 'DAI/USDT', 'SELL')], 50.0)
+    cid = journal.intent('DAIUSDT', 'SELL', {'quantity': '50'})
+    journal.local.swap = None
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write('{"type": "done", "cid"')  # 崩溃时写了一半的最后一行
+    notes = account.journal.recover(account)
+    assert notes == [f"在途订单 {cid} DAIUSDT SELL: NOT_FOUND"]
+    assert journal.recovered and account.ledger.drift
+    swaps, intents, done = journal.replay()
+    assert swaps == {} and intents == {} and swap_id not in swaps
+    assert os.path.getsize(journal.path) == 0
+
+
+def test_journal_is_exclusive_to_one_process(hsl, tmp_path):
+    if hsl.fcntl is None:
+        pytest.skip("需要 fcntl 文件锁")
+    path = str(tmp_path / 'order_journal.jsonl')
+    owner = hsl.OrderJournal(path)
+    owner.intent('DAIUSDT', 'SELL', {'quantity': '50'})
+    other = hsl.OrderJournal(path)
+    with pytest.raises(hsl.JournalLocked):
+        other.open()
+    owner.compact()  # 原地清空，锁仍然有效
+    with pytest.raises(hsl.JournalLocked):
+        other.open()
+    owner.intent('DAIUSDT', 'BUY', {'quantity': '50'})
+    assert len(owner.replay()[1]) == 1
+    owner.file.close()
+    other.open()
+
+
+def test_kline_store_has_one_writer(hsl, tmp_path):
+    if hsl.fcntl is None:
+        pytest.skip("需要 fcntl 文件锁")
+    writer = hsl.KlineStore(str(tmp_path))
+    reader = hsl.KlineStore(str(tmp_path))
+    writer.append('DAI/USDT', '5m', [[300_000, '1', '1', '1', '1', '1']])
+    reader.append('DAI/USDT', '5m', [[300_000, '1', '1', '1', '1', '1'], [600_000, '1', '1', '1', '1', '1']])
+    writer.append('DAI/USDT', '5m', [[600_000, '1', '1', '1', '1', '1']])
+    assert reader.lock_file is False
+    assert reader.load('DAI/USDT', '5m')['open_time'].tolist() == [300_000, 600_000]
+
+
+def test_accounts_share_one_request_budget(hsl):
+    first = hsl.WeightBudget(object())
+    second = hsl.WeightBudget(object())
+    assert first.budget is second.budget is hsl.request_budget
+
+
+def test_request_weights_follow_symbol_count(hsl):
+    budget = hsl.RequestBudget()
+    assert budget.cost('book_ticker', {'symbol': 'DAIUSDT'}) == 2
+    assert budget.cost('book_ticker', {'symbols': ['DAIUSDT', 'FDUSDUSDT']}) == 4
+    assert budget.cost('ticker_price', {'symbols': ['DAIUSDT']}) == 4
+    assert budget.cost('ping', {}) == 1
+
+
+def test_status_reports_each_account(hsl, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first = hsl.Account.from_config('a', {'pairs': ['DAI/USDT'], 'execution_mode': 'MAKER'})
+    second = hsl.Account.from_config('b', {'pairs': ['FDUSD/USDT']})
+    first.ledger.state = first.ledger.state.replace(free={'USDT': 10.0})
+    second.ledger.state = second.ledger.state.replace(free={'USDT': 20.0})
+    monkeypatch.setattr(hsl, 'accounts', [first, second])
+    status = hsl.status_snapshot()
+    assert 'balances' not in status and 'maker' not in status
+    assert status['accounts']['a']['balances'] == {'USDT': 10.0} and status['accounts']['a']['execution_mode'] == 'MAKER'
+    assert status['accounts']['b']['balances'] == {'USDT': 20.0} and status['accounts']['b']['pairs'] == ['FDUSD/USDT']
+    monkeypatch.setattr(hsl, 'accounts', [])
+    assert 'accounts' not in hsl.status_snapshot() and 'balances' in hsl.status_snapshot()
+
+
+def test_first_trade_waits_for_market_data(hsl, account, monkeypatch):
+    class Scheduler:
+        def __init__(self):
+            self.scheduled = []
+
+        def schedule(self, name, when):
+            self.scheduled.append(name)
+
+    account.selected_pairs = ['DAI/USDT']
+    account.dry_run = True
+    account.scheduler = Scheduler()
+    monkeypatch.setattr(hsl, 'market_state', hsl.MarketSnapshot(prices={}, mas={}))
+    retry_at = hsl.trade_task(account)
+    assert account.last_trade_time is None  # 行情未到不进入冷却
+    assert retry_at <= time.time() + hsl.MARKET_WAIT_SECONDS
+    monkeypatch.setattr(hsl, 'market_state', hsl.MarketSnapshot(prices={'DAI/USDT': 1.0}, mas={'DAI/USDT': 1.0}))
+    next_at = hsl.trade_task(account)
+    assert account.last_trade_time is not None
+    assert next_at == pytest.approx(account.last_trade_time.timestamp() + account.trade_cooldown)
+    assert account.scheduler.scheduled == ['prefetch']
@@ -10,11 +10,15 @@ import psutil
 import os
 import json
 from datetime import datetime
+from types import MappingProxyType
 import requests
 import sys
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing import shared_memory, resource_tracker
 from binance.spot import Spot
 from binance.lib.utils import config_logging
 from binance.error import ClientError, ServerError
+from binance.websocket.spot.websocket_stream import SpotWebsocketStreamClient
 
 # 配置日志，仅保留文件日志输出
 logging.basicConfig(
@@ -104,14 +108,29 @@ def test_network():
         logging.error(f"网络连接测试失败: {e}")
         return False
 
+# 交易对索引缓存：exchange_info 与API密钥无关，启动、验证和更换密钥共用一次拉取
+SYMBOL_INDEX = set()
+SYMBOL_INDEX_TIME = 0
+SYMBOL_INDEX_TTL = 6 * 3600
+
+# 获取交易对索引，缓存过期才重新拉取
+def get_symbol_index(client):
+    global SYMBOL_INDEX, SYMBOL_INDEX_TIME
+    if not SYMBOL_INDEX or time.time() - SYMBOL_INDEX_TIME > SYMBOL_INDEX_TTL:
+        response = client.exchange_info()
+        SYMBOL_INDEX = {s['symbol'] for s in response['symbols']}
+        SYMBOL_INDEX_TIME = time.time()
+        logging.info(f"已加载交易对索引: {len(SYMBOL_INDEX)} 个交易对")
+    return SYMBOL_INDEX
+
 # 验证交易对
 def validate_pairs(client, pairs):
     try:
-        response = client.exchange_info()
+        symbols = get_symbol_index(client)
         valid_pairs = []
         for pair in pairs:
             symbol = pair.replace('/', '')
-            if any(s['symbol'] == symbol for s in response['symbols']):
+            if symbol in symbols:
                 valid_pairs.append(pair)
                 logging.info(f"交易对 {pair} 验证通过")
             else:
@@ -128,8 +147,7 @@ def validate_pairs(client, pairs):
 # 检查交易对支持
 def check_pair_support(client):
     try:
-        response = client.exchange_info()
-        symbols = [s['symbol'] for s in response['symbols']]
+        symbols = get_symbol_index(client)
         supported = {}
         for pair in ['DAIUSDT', 'FDUSDUSDT', 'USDCUSDT']:
             supported[pair] = pair in symbols
@@ -146,8 +164,163 @@ binance = None
 COINS = ['USDT', 'USDC', 'FDUSD', 'DAI']
 PAIRS = ['DAI/USDT', 'FDUSD/USDT', 'USDC/USDT']
 
-# 实盘余额
-BALANCES = {}
+# 实盘余额：只读映射，不在原地修改。写入方（用户数据流、对账）在锁内基于当前余额生成新映射后整体替换，
+# 读取方取一次引用即得到同一版本，不加锁，也不会读到更新了一半的余额
+BALANCES = MappingProxyType({})
+BALANCES_LOCK = threading.Lock()
+
+def publish_balances(changes):
+    global BALANCES
+    with BALANCES_LOCK:
+        BALANCES = MappingProxyType({**BALANCES, **changes})
+        return BALANCES
+
+# 每轮行情拉取截止时间（秒），超时的交易对本轮跳过
+MARKET_DATA_DEADLINE = 8
+
+# 本机价格总线（由 v1.3 以 price_bus: publish 运行的进程发布），布局与 v1.3 一致；
+# 发布方在头部写入布局版本 PRICE_BUS_LAYOUT，v1.3 修改布局时同时加一，版本不一致则不读取
+PRICE_BUS_NAME = 'hsl_price_bus'
+PRICE_BUS_SLOTS = 32
+PRICE_BUS_MAX_AGE = 120  # 超过此时间（秒）未更新的记录视为失效
+PRICE_BUS_READ_RETRIES = 20  # 读到写入中的数据时的重试次数，用尽后沿用上次读到的完整数据
+PRICE_BUS_RETRY_SLEEP = 0.0005  # 重试前让出 CPU（秒）
+PRICE_BUS_LAYOUT = 1
+PRICE_BUS_HEADER = np.dtype([('layout', '<u8'), ('seq', '<u8'), ('count', '<i8'), ('interval_ms', '<i8'),
+                             ('ma_period', '<i8'), ('updated', '<i8')])
+PRICE_BUS_RECORD = np.dtype([('pair', 'S16'), ('price', '<f8'), ('ma', '<f8'), ('ts', '<i8')])
+PRICE_BUS_INTERVAL_MS = 4 * 3600 * 1000  # 本版本只用 4 小时 MA30
+PRICE_BUS_MA_PERIOD = 30
+
+# 价格总线布局版本与本程序不一致
+class PriceBusLayoutError(Exception):
+    pass
+
+# 价格总线读取：序号为偶数且前后一致时数据完整（seqlock），直接读映射内存，不加锁
+class PriceBusReader:
+    def __init__(self, name=PRICE_BUS_NAME):
+        self.shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(self.shm._name, 'shared_memory')  # 内存块归发布方回收
+        self.header = np.ndarray((), dtype=PRICE_BUS_HEADER, buffer=self.shm.buf)
+        self.records = np.ndarray((PRICE_BUS_SLOTS,), dtype=PRICE_BUS_RECORD, buffer=self.shm.buf,
+                                  offset=PRICE_BUS_HEADER.itemsize)
+        self.index = {}
+        self.last = {}  # pair -> 上次读到的完整记录 (price, ma30, ts)
+        layout = int(self.header['layout'])
+        if layout != PRICE_BUS_LAYOUT:
+            self.header = self.records = None
+            self.shm.close()
+            raise PriceBusLayoutError(f"价格总线布局版本 {layout}，本程序为 {PRICE_BUS_LAYOUT}")
+
+    # 返回 {pair: (price, ma30)}，只含未过期的交易对
+    def read(self, pairs):
+        header = self.header
+        if int(header['layout']) != PRICE_BUS_LAYOUT:
+            return {}
+        for attempt in range(PRICE_BUS_READ_RETRIES):
+            if attempt:
+                time.sleep(PRICE_BUS_RETRY_SLEEP)
+            seq = int(header['seq'])
+            if seq & 1:
+                continue
+            if int(header['interval_ms']) != PRICE_BUS_INTERVAL_MS or int(header['ma_period']) != PRICE_BUS_MA_PERIOD:
+                self.last = {}
+                return {}
+            count = int(header['count'])
+            if len(self.index) != count:
+                self.index = {pair.decode(): i for i, pair in enumerate(self.records['pair'][:count])}
+            slots = [(pair, self.index[pair]) for pair in pairs if pair in self.index]
+            values = [(pair, float(self.records['price'][i]), float(self.records['ma'][i]), int(self.records['ts'][i]))
+                      for pair, i in slots]
+            moved = any(self.records['pair'][i].decode() != pair for pair, i in slots)
+            if int(header['seq']) == seq:
+                if not moved:
+                    break
+                self.index = {}  # 发布方重启后下标重排，重建后重读
+        else:
+            values = []  # 发布方一直在写入：沿用上次的完整数据
+        for pair, price, ma, ts in values:
+            self.last[pair] = (price, ma, ts)
+        oldest = int(time.time() * 1000) - PRICE_BUS_MAX_AGE * 1000
+        return {pair: self.last[pair][:2] for pair in pairs if pair in self.last and self.last[pair][2] >= oldest}
+
+# 用户数据流配置
+USER_STREAM_URL = 'wss://stream.binance.com:9443'
+LISTEN_KEY_KEEPALIVE = 30 * 60  # listenKey 续期间隔（秒）
+USER_STREAM_WAIT = 2  # 成交后等待账户推送的最长时间（秒）
+
+# 用户数据流：listenKey 订阅 outboundAccountPosition，推送到达即更新 BALANCES；
+# 只在（重新）连接后调用一次 account() 对账，不再每轮轮询
+class UserDataStream:
+    def __init__(self, client, on_balances, ws_factory=SpotWebsocketStreamClient, stream_url=USER_STREAM_URL):
+        self.client = client
+        self.on_balances = on_balances
+        self.ws_factory = ws_factory  # 便于用本地推送桩替换
+        self.stream_url = stream_url
+        self.listen_key = None
+        self.ws_client = None
+        self.connected = False
+        self.last_keepalive = 0
+        self.last_account_update = 0
+        self.updated = threading.Condition()
+
+    def start(self):
+        self.listen_key = self.client.new_listen_key()['listenKey']
+        self.last_keepalive = time.time()
+        self.ws_client = self.ws_factory(
+            stream_url=self.stream_url,
+            on_message=self.on_message,
+            on_close=self.on_close,
+            on_error=self.on_error,
+            is_combined=True
+        )
+        self.ws_client.user_data(listen_key=self.listen_key)
+        self.connected = True
+
+    def stop(self):
+        self.connected = False
+        try:
+            if self.ws_client:
+                self.ws_client.stop()
+            if self.listen_key:
+                self.client.close_listen_key(self.listen_key)
+        except Exception:
+            pass
+        self.ws_client = None
+        self.listen_key = None
+
+    def keepalive(self):
+        if self.listen_key and time.time() - self.last_keepalive >= LISTEN_KEY_KEEPALIVE:
+            self.client.renew_listen_key(self.listen_key)
+            self.last_keepalive = time.time()
+
+    def on_close(self, _):
+        self.connected = False
+        logging.warning("用户数据流连接已关闭")
+
+    def on_error(self, _, error):
+        self.connected = False
+        logging.warning(f"用户数据流错误: {error}")
+
+    def on_message(self, _, message):
+        try:
+            data = json.loads(message)
+            data = data.get('data', data)
+            event = data.get('e')
+            if event == 'outboundAccountPosition':
+                publish_balances({asset['a']: float(asset['f']) for asset in data['B'] if asset['a'] in COINS})
+                self.on_balances()
+                with self.updated:
+                    self.last_account_update = max(self.last_account_update, data.get('u', data.get('E', 0)))
+                    self.updated.notify_all()
+            elif event == 'listenKeyExpired':
+                self.connected = False
+        except Exception as e:
+            logging.warning(f"解析用户数据流失败: {e}")
+
+    def wait_for_update(self, after_ms, timeout=USER_STREAM_WAIT):
+        with self.updated:
+            return self.updated.wait_for(lambda: self.last_account_update >= after_ms, timeout=timeout)
 
 class ApiKeyDialog(tk.Toplevel):
     def __init__(self, parent, callback):
@@ -224,6 +397,9 @@ class ArbitrageApp:
         self.api_button.place(x=120, y=570)
 
         self.running = True
+        self.market_data_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='market_data')
+        self.user_stream = None
+        self.price_bus = None
         self.network_connected = True
         self.last_trade_time = time.time()
         self.network_failure_count = 0
@@ -281,19 +457,12 @@ class ArbitrageApp:
                 time.sleep(300)
 
     def initialize_balances(self):
-        global BALANCES
         try:
             response = binance.account()
-            for coin in COINS:
-                for asset in response['balances']:
-                    if asset['asset'] == coin:
-                        BALANCES[coin] = float(asset['free'])
-                        break
-                else:
-                    BALANCES[coin] = 0.0
-            self.log(f"初始余额: {BALANCES}")
-            balance_text = "\n".join([f"{coin}: {BALANCES[coin]:.2f}" for coin in COINS])
-            self.root.after(0, lambda: self.balance_label.config(text=f"持仓:\n{balance_text}"))
+            free = {asset['asset']: float(asset['free']) for asset in response['balances']}
+            balances = publish_balances({coin: free.get(coin, 0.0) for coin in COINS})
+            self.log(f"初始余额: {dict(balances)}")
+            self.show_balances()
         except ClientError as e:
             if e.error_code == -2014 or "API-key format invalid" in e.error_message:
                 self.log(f"初始化余额失败：API密钥无效 - {e.error_message}")
@@ -316,23 +485,15 @@ class ArbitrageApp:
                 self.network_failure_count = 0
             return False
 
+        # ping 已确认可达，再用权重1的 time 接口确认客户端可用，不再拉取24小时行情
         try:
-            binance.ticker_24hr(symbol=PAIRS[0].replace('/', ''))
+            binance.time()
             self.network_failure_count = 0
-            self.log(f"网络检查成功: {PAIRS[0]}")
+            self.log("网络检查成功")
             return True
         except ClientError as e:
             self.network_failure_count += 1
             self.log(f"网络错误 ({self.network_failure_count}/{self.max_network_failures}): {e.error_message} (code: {e.error_code})")
-            try:
-                binance.ticker_24hr(symbol='BTCUSDT')
-                self.network_failure_count = 0
-                self.log("网络检查成功: BTC/USDT")
-                return True
-            except ClientError as e2:
-                self.log(f"备用交易对(BTC/USDT)错误: {e2.error_message} (code: {e2.error_code})")
-            except Exception as e2:
-                self.log(f"备用交易对检查失败: {e2}")
             if self.network_failure_count >= self.max_network_failures:
                 self.log("连续网络失败，请检查网络或API密钥！尝试重置API连接...")
                 try:
@@ -385,11 +546,35 @@ class ArbitrageApp:
         self.log(f"获取{symbol} MA30失败：多次尝试无果")
         return None, None
 
+    # 同机有发布进程时从价格总线读取；总线不存在时每轮重试连接
+    def read_price_bus(self):
+        if self.price_bus is None:
+            try:
+                self.price_bus = PriceBusReader()
+                self.log("已连接价格总线")
+            except FileNotFoundError:
+                return {}
+            except PriceBusLayoutError as e:
+                self.log(f"价格总线版本不一致，改用 REST: {e}")
+                return {}
+        return self.price_bus.read(PAIRS)
+
     def get_all_prices_and_ma(self):
         prices = {}
         ma_values = {}
+        results = self.read_price_bus()
+        # 总线没有的交易对并发拉取，单个交易对重试不再拖慢整轮
+        futures = {self.market_data_pool.submit(self.get_4h_ma30, pair): pair for pair in PAIRS if pair not in results}
+        done, not_done = wait(futures, timeout=MARKET_DATA_DEADLINE) if futures else (set(), set())
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                self.log(f"获取{futures[future]} MA30失败: {e}")
+        for future in not_done:
+            self.log(f"获取{futures[future]} MA30超时，本轮跳过")
         for pair in PAIRS:
-            price, ma30 = self.get_4h_ma30(pair)
+            price, ma30 = results.get(pair, (None, None))
             if price is not None and ma30 is not None:
                 prices[pair] = price
                 ma_values[pair] = ma30
@@ -401,19 +586,12 @@ class ArbitrageApp:
         return prices, ma_values
 
     def update_balances(self):
-        global BALANCES
         try:
             response = binance.account()
-            for coin in COINS:
-                for asset in response['balances']:
-                    if asset['asset'] == coin:
-                        BALANCES[coin] = float(asset['free'])
-                        break
-                else:
-                    BALANCES[coin] = 0.0
-            self.log(f"更新余额: {BALANCES}")
-            balance_text = "\n".join([f"{coin}: {BALANCES[coin]:.2f}" for coin in COINS])
-            self.root.after(0, lambda: self.balance_label.config(text=f"持仓:\n{balance_text}"))
+            free = {asset['asset']: float(asset['free']) for asset in response['balances']}
+            balances = publish_balances({coin: free.get(coin, 0.0) for coin in COINS})
+            self.log(f"更新余额: {dict(balances)}")
+            self.show_balances()
         except ClientError as e:
             if e.error_code == -2014 or "API-key format invalid" in e.error_message:
                 self.log(f"更新余额失败：API密钥无效 - {e.error_message}")
@@ -426,17 +604,50 @@ class ArbitrageApp:
         except Exception as e:
             self.log(f"更新余额失败: {e}")
 
+    def show_balances(self):
+        balances = BALANCES
+        balance_text = "\n".join([f"{coin}: {balances.get(coin, 0.0):.2f}" for coin in COINS])
+        self.root.after(0, lambda: self.balance_label.config(text=f"持仓:\n{balance_text}"))
+
+    # 保持用户数据流在线；断线重连后对账一次，流不可用时回退 account() 轮询
+    def ensure_user_stream(self):
+        stream = self.user_stream
+        if stream and stream.connected:
+            try:
+                stream.keepalive()
+                return
+            except Exception as e:
+                self.log(f"listenKey 续期失败，重建用户数据流: {e}")
+        if stream:
+            stream.stop()
+        self.user_stream = None
+        try:
+            stream = UserDataStream(binance, self.show_balances)
+            stream.start()
+            self.user_stream = stream
+            self.log("用户数据流已连接，余额改为推送更新")
+        except Exception as e:
+            self.log(f"启动用户数据流失败，回退轮询: {e}")
+        self.update_balances()
+
+    # 成交后同步余额：优先等待推送，超时或流不可用时查询一次账户
+    def sync_balances(self, after_ms=0):
+        stream = self.user_stream
+        if stream and stream.connected and stream.wait_for_update(after_ms):
+            return
+        self.update_balances()
+
     def execute_trade(self, from_coin, to_coin, amount, prices, trade_speed):
-        global BALANCES
+        balances = BALANCES  # 本笔交易只使用这一份余额快照
         if from_coin == to_coin:
             return False, f"无效交易: {from_coin} -> {to_coin}"
 
-        amount = BALANCES[from_coin] * trade_speed
+        amount = balances[from_coin] * trade_speed
         amount = int(amount)
         if amount < 5:
-            amount = 5 if BALANCES[from_coin] >= 5 else int(BALANCES[from_coin])
+            amount = 5 if balances[from_coin] >= 5 else int(balances[from_coin])
         if amount < 5:
-            return False, f"数量不足5枚: {from_coin} (余额: {BALANCES[from_coin]:.2f})"
+            return False, f"数量不足5枚: {from_coin} (余额: {balances[from_coin]:.2f})"
 
         try:
             if from_coin != 'USDT' and to_coin == 'USDT':
@@ -461,7 +672,7 @@ class ArbitrageApp:
                     to_amount = amount / prices[pair]
                     to_amount = int(to_amount)
                     if to_amount < 5:
-                        to_amount = 5 if BALANCES[from_coin] >= 5 * prices[pair] else int(BALANCES[from_coin] / prices[pair])
+                        to_amount = 5 if balances[from_coin] >= 5 * prices[pair] else int(balances[from_coin] / prices[pair])
                     if to_amount < 5:
                         return False, f"目标数量不足5枚: {to_coin} (可得: {to_amount})"
                     params = {
@@ -499,7 +710,7 @@ class ArbitrageApp:
                     amount = usdt_amount / prices[usdt_pair]
                     amount = int(amount)
                     if amount < 5:
-                        amount = 5 if BALANCES[from_coin] >= 5 else int(BALANCES[from_coin])
+                        amount = 5 if balances[from_coin] >= 5 else int(balances[from_coin])
                     if amount < 5:
                         return False, f"数量不足5枚: {from_coin} (需: {amount})"
                     params = {
@@ -519,8 +730,9 @@ class ArbitrageApp:
                 }
                 buy_order = binance.new_order(**params)
                 self.log(f"执行买单: USDT -> {to_amount:.0f} {to_coin}, 订单ID: {buy_order['orderId']}")
+                order = buy_order
 
-            self.update_balances()
+            self.sync_balances(order.get('transactTime', 0))
             speed_text = "50%" if trade_speed == 0.5 else "10%"
             return True, f"交易成功: {amount:.0f} {from_coin} -> {to_amount:.0f} {to_coin} ({speed_text}速度)"
         except ClientError as e:
@@ -548,10 +760,10 @@ class ArbitrageApp:
                         self.network_connected = True
                         self.root.after(0, lambda: self.status_label.config(text="状态: 网络恢复，运行中"))
                         self.log("网络恢复，继续运行")
-                        self.update_balances()
+                        self.ensure_user_stream()
                     continue
 
-                self.update_balances()
+                self.ensure_user_stream()
                 prices, ma_values = self.get_all_prices_and_ma()
 
                 if not self.network_connected:
@@ -612,8 +824,7 @@ class ArbitrageApp:
                             success, msg = self.execute_trade(from_coin, to_coin, BALANCES[from_coin], prices, trade_speeds[from_coin])
                             self.log(msg)
                             if success:
-                                balance_text = "\n".join([f"{coin}: {BALANCES[coin]:.2f}" for coin in COINS])
-                                self.root.after(0, lambda: self.balance_label.config(text=f"持仓:\n{balance_text}"))
+                                self.show_balances()
                             break
 
                     if 'USDT' not in above_ma_coins:
@@ -623,8 +834,7 @@ class ArbitrageApp:
                             success, msg = self.execute_trade('USDT', to_coin, BALANCES['USDT'], prices, trade_speeds.get('USDT', 0.1))
                             self.log(msg)
                             if success:
-                                balance_text = "\n".join([f"{coin}: {BALANCES[coin]:.2f}" for coin in COINS])
-                                self.root.after(0, lambda: self.balance_label.config(text=f"持仓:\n{balance_text}"))
+                                self.show_balances()
 
             except Exception as e:
                 self.log(f"更新数据失败: {e}")
@@ -811,6 +1021,8 @@ class ArbitrageApp:
 
     def on_closing(self):
         self.running = False
+        if self.user_stream:
+            self.user_stream.stop()
         self.root.destroy()
 
 if __name__ == "__main__":
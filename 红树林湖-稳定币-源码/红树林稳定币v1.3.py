@@ -1,6 +1,7 @@
 from binance.spot import Spot
+from binance.error import ClientError
+from binance.websocket.spot.websocket_stream import SpotWebsocketStreamClient
 import numpy as np
-import dearpygui.dearpygui as dpg
 import json
 import os
 import time
@@ -8,43 +9,172 @@ import threading
 import gc
 from datetime import datetime, timedelta
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, wait
 import traceback
+from decimal import Decimal, ROUND_DOWN
+import bisect
+import heapq
+import itertools
 import logging
-
-# 设置日志
-logging.basicConfig(filename='bot.log', level=logging.INFO, format='%(asctime)s %(message)s')
+import logging.handlers
+import argparse
+import signal
+import socket
+import socketserver
+from types import MappingProxyType
+from multiprocessing import shared_memory, resource_tracker
+try:
+    import fcntl  # 订单日志和本地K线库的进程间排他锁（Windows 上没有，不加锁）
+except ImportError:
+    fcntl = None
 
 # API 密钥存储文件
 CONFIG_FILE = 'binance_config.json'
 
+# 无界面模式：状态查询地址（支持 Unix 域套接字时用文件路径，否则为本机 TCP 端口）
+STATUS_SOCKET = 'hsl_status.sock'
+STATUS_PORT = 8765
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 日志文件轮转大小
+LOG_BACKUPS = 5
+
+# 本机价格总线：一个进程发布行情到共享内存，同机其他进程直接读取
+PRICE_BUS_NAME = 'hsl_price_bus'
+PRICE_BUS_SLOTS = 32  # 最多发布的交易对数
+PRICE_BUS_READ_RETRIES = 20  # 读到写入中的数据时的重试次数，用尽后沿用上次读到的完整数据
+PRICE_BUS_RETRY_SLEEP = 0.0005  # 重试前让出 CPU，等待发布方写完（秒）
+PRICE_BUS_LAYOUT = 1  # 内存布局版本，修改头部或记录结构时加一（v1.2 的读取方核对同一版本号）
+PRICE_BUS_HEADER = np.dtype([('layout', '<u8'), ('seq', '<u8'), ('count', '<i8'), ('interval_ms', '<i8'),
+                             ('ma_period', '<i8'), ('updated', '<i8')])
+PRICE_BUS_RECORD = np.dtype([('pair', 'S16'), ('price', '<f8'), ('ma', '<f8'), ('ts', '<i8')])
+
+# REST 地址
+API_BASE_URL = 'https://api.binance.com'
+
+# 行情 WebSocket 地址（可改为本地 WebSocket 测试服务器，如 ws://127.0.0.1:9443）
+STREAM_URL = 'wss://stream.binance.com:9443'
+STREAM_STALE_SECONDS = 60  # 超过该时间无推送视为断流，回退 REST
+STREAM_CLOSE_GRACE_MS = 10_000  # K线收盘后等待推送送达的宽限时间（毫秒）
+BASE_INTERVAL = '1m'  # 推送订阅的基础周期，其余周期本地聚合
+
+# 事件调度间隔（秒）
+UI_REFRESH_SECONDS = 5  # 推送正常时界面刷新间隔，只读内存不发请求
+REST_REFRESH_SECONDS = 60  # 推送不可用时行情轮询间隔
+BALANCE_REFRESH_SECONDS = 300  # 余额刷新间隔
+PREFETCH_SECONDS = 15  # 交易前提前刷新行情和余额
+CANDLE_CLOSE_DELAY = 2  # K线收盘后延迟刷新 MA
+RETRY_SECONDS = 5  # 任务出错后的重试间隔
+MARKET_WAIT_SECONDS = 1  # 行情未就绪时推迟交易的间隔
+SCHEDULER_MAX_SLEEP = 60  # 调度线程单次最长休眠
+EXCHANGE_INFO_TTL = 6 * 3600  # 交易规则缓存有效期（秒），过期后后台刷新
+USER_STREAM_CHECK_SECONDS = 60  # 用户数据流在线检查间隔
+LISTEN_KEY_KEEPALIVE = 30 * 60  # listenKey 续期间隔
+LEDGER_RECONCILE_SECONDS = 1800  # 本地账本与交易所对账间隔
+LEDGER_DRIFT_TOLERANCE = 0.01  # 对账差额超过该值视为账本漂移
+
+# 兑换路由：默认吃单手续费率、个别交易对费率（如零手续费稳定币对）、每多一跳的额外成本（延迟与滑点）
+ROUTE_FEE_RATE = 0.001
+ROUTE_FEE_RATES = {}  # symbol -> 手续费率
+ROUTE_HOP_PENALTY = 0.0001
+ROUTE_MAX_HOPS = 2
+ORDER_WORKERS = 4  # 同一轮内并发下单的最大线程数
+MAKER_REPLACE_SECONDS = 10  # 挂单未成交时撤单重挂的间隔
+MAKER_DEADLINE_SECONDS = 60  # 超过该时间仍未成交的部分改用市价单
+MAKER_POLL_SECONDS = 1  # 用户数据流不可用时查询挂单状态的间隔
+MAKER_REPOST_BACKOFF = 0.5  # 挂单因会立即成交被拒后，重新取盘口前的等待（秒）
+MAKER_MAX_REPOSTS = 10  # 每笔兑换因会立即成交被拒的最多重挂次数，超过后剩余部分改用市价单
+ORDER_JOURNAL_FILE = 'order_journal.jsonl'  # 订单预写日志
+
+# 请求权重：每分钟上限（启动时按 exchange_info 的 rateLimits 校准）及各接口权重
+WEIGHT_LIMIT = 6000
+REQUEST_WEIGHTS = {'exchange_info': 20, 'account': 20, 'klines': 2, 'ticker_price': 2, 'book_ticker': 2,
+                   'new_order': 1, 'cancel_order': 1, 'get_order': 4, 'time': 1, 'ping': 1}
+# 请求优先级及可使用的预算比例：下单始终有余量，低优先级（界面刷新、健康检查）最先被推迟
+PRIORITY_ORDER, PRIORITY_NORMAL, PRIORITY_LOW = 0, 1, 2
+PRIORITY_SHARE = {PRIORITY_ORDER: 1.0, PRIORITY_NORMAL: 0.8, PRIORITY_LOW: 0.5}
+REQUEST_PRIORITY = {'new_order': PRIORITY_ORDER, 'cancel_order': PRIORITY_ORDER,
+                    'time': PRIORITY_LOW, 'ping': PRIORITY_LOW}
+MARKET_DATA_DEADLINE = 4  # 每轮行情拉取截止时间（秒），超时的交易对本轮跳过
+
+# 不可变状态快照：__slots__ 实例、禁止赋值，字段为只读映射。写入方基于当前快照生成新版本，
+# 用一次引用赋值发布；读取方只取一次引用，之后看到的始终是同一版本，不加锁，也不会读到更新了一半的状态
+class FrozenSnapshot:
+    __slots__ = ('version', 'updated')
+    FIELDS = ()
+
+    def __init__(self, version=0, **fields):
+        for name in self.FIELDS:
+            object.__setattr__(self, name, MappingProxyType(dict(fields[name])))
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'updated', time.time())
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"状态快照不可修改: {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"状态快照不可修改: {name}")
+
+    # 生成下一版本，未给出的字段沿用当前值
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.FIELDS}
+        fields.update(changes)
+        return type(self)(version=self.version + 1, **fields)
+
+# 每轮行情刷新发布一次：{pair: 价格}、{pair: MA}
+class MarketSnapshot(FrozenSnapshot):
+    __slots__ = ('prices', 'mas')
+    FIELDS = __slots__
+
+# 账本每次记账、推送或对账后发布一次：{coin: 可用余额}
+class BalanceSnapshot(FrozenSnapshot):
+    __slots__ = ('free',)
+    FIELDS = __slots__
+
 # 全局变量
+dpg = None  # DearPyGui 在创建界面时才导入，无界面模式不加载
 client = None
 running = False
-lock = threading.Lock()
 animation_frame = 0
 update_queue = Queue(maxsize=100)  # 限制队列大小
+market_data_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='market_data')  # 行情并发拉取线程池
 # 所有支持的稳定币和默认交易对
 ALL_COINS = ['USDT', 'USDC', 'FDUSD', 'DAI', 'USD1', 'XUSD', 'TUSD', 'USDP']
 DEFAULT_PAIRS = ['DAI/USDT', 'FDUSD/USDT', 'USDC/USDT', 'USD1/USDT', 'XUSD/USDT', 'TUSD/USDT', 'USDP/USDT']
 selected_pairs = [pair for pair in DEFAULT_PAIRS if pair != 'USD1/USDT']  # 默认排除 USD1/USDT
-current_prices = {pair: 0.0 for pair in selected_pairs}
-ma_values = {pair: 0.0 for pair in selected_pairs}
+market_state = MarketSnapshot(prices={}, mas={})  # 当前行情快照，只整体替换
 price_update_time = None
-balances = {coin: 0.0 for coin in ALL_COINS}
-last_trade_time = None
 trade_speed = 0.1  # 默认10%
 ma_threshold = 0.0001  # 默认0.01%
 ma_period = 30  # 默认MA30
 trade_cooldown = 3600  # 默认1小时（秒）
 kline_interval = '4h'  # 默认4小时K线
+dry_run = False  # 模拟运行：只生成订单计划和预估成本，不下单
+execution_mode = 'MARKET'  # 下单方式：MARKET 市价单，MAKER 只挂单（LIMIT_MAKER），超时后市价兜底
+maker_replace_seconds = MAKER_REPLACE_SECONDS  # 挂单撤单重挂间隔（秒）
+maker_deadline_seconds = MAKER_DEADLINE_SECONDS  # 挂单改市价前的最长等待（秒）
+maker_max_reposts = MAKER_MAX_REPOSTS  # 挂单因会立即成交被拒的最多重挂次数
+FAST_DEVIATION = 0.0005  # 偏离超过0.05%时提高交易比例
+FAST_TRADE_SPEED = 0.5  # 提高后的交易比例50%
+kline_stream = None  # K 线推送引擎
+kline_lock = threading.Lock()  # 保护 MA 缓冲与推送数据
+ma_buffers = {}  # (pair, interval) -> RollingMA
+MA_CAPACITY = 100  # 与设置界面允许的最大 MA 周期一致
+KLINE_CACHE_SIZE = 1000  # 每个 (交易对, 周期) 最多缓存的已收盘K线数
+KLINE_STORE_DIR = 'kline_store'  # 本地K线库目录
+KLINE_DTYPE = np.dtype([('open_time', '<i8'), ('open', '<f8'), ('high', '<f8'),
+                        ('low', '<f8'), ('close', '<f8'), ('volume', '<f8')])
+# K 线周期对应毫秒数
+INTERVAL_MS = {
+    '1m': 60_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+    '1h': 3_600_000, '4h': 14_400_000, '1d': 86_400_000
+}
 
 # 加载或保存 API 密钥
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        if os.path.getsize(CONFIG_FILE) == 0:
+def load_config(path=CONFIG_FILE):
+    if os.path.exists(path):
+        if os.path.getsize(path) == 0:
             return {}
         try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            with open(path, 'r', encoding='utf-8') as f:
                 content = f.read().strip()
                 if not content:
                     return {}
@@ -56,7 +186,7 @@ def load_config():
     return {}
 
 def save_config(api_key, api_secret):
-    config = {'api_key': api_key, 'api_secret': api_secret}
+    config = {**load_config(), 'api_key': api_key, 'api_secret': api_secret}  # 保留配置文件中的其他设置
     try:
         with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
             json.dump(config, f, ensure_ascii=False, indent=4)
@@ -64,27 +194,274 @@ def save_config(api_key, api_secret):
     except Exception:
         update_queue_put("status_label", "保存 API 密钥失败")
 
+# 请求预算不足时推迟的低优先级请求
+class WeightBudgetExceeded(Exception):
+    pass
+
+# 请求权重预算：按接口权重预留，响应后用 X-MBX-USED-WEIGHT-1M 校准（该值按 IP 统计，所以进程内的行情客户端
+# 和所有账户的客户端共用一份预算）；预算紧张时低优先级请求直接推迟，普通请求等到下一分钟，
+# 下单可用全部预算；收到 429/418 时按 Retry-After 暂停
+class RequestBudget:
+    def __init__(self, limit=WEIGHT_LIMIT):
+        self.limit = limit
+        self.used = 0
+        self.minute = int(time.time() // 60)
+        self.banned_until = 0
+        self.deferred = 0  # 被推迟的低优先级请求数
+        self.lock = threading.Lock()
+
+    # 价格/盘口接口：单个交易对权重2，多个交易对（或全部）权重4
+    def cost(self, name, kwargs):
+        if name in ('ticker_price', 'book_ticker') and not kwargs.get('symbol'):
+            return 4
+        return REQUEST_WEIGHTS.get(name, 1)
+
+    # 尝试预留预算：成功返回 0，否则返回建议等待的秒数；低优先级直接推迟
+    def try_reserve(self, name, cost, priority):
+        with self.lock:
+            now = time.time()
+            if int(now // 60) != self.minute:
+                self.minute = int(now // 60)
+                self.used = 0
+            if now >= self.banned_until and self.used + cost <= self.limit * PRIORITY_SHARE[priority]:
+                self.used += cost
+                return 0
+            if priority == PRIORITY_LOW:
+                self.deferred += 1
+                raise WeightBudgetExceeded(f"请求权重不足，推迟 {name}")
+            wait_until = max(self.banned_until, (self.minute + 1) * 60)
+        return min(max(wait_until - now, 0.05), 5)
+
+    def reserve(self, name, cost, priority):
+        while True:
+            delay = self.try_reserve(name, cost, priority)
+            if not delay:
+                return
+            time.sleep(delay)
+
+    # 按响应头中的已用权重校准
+    def calibrate(self, used):
+        with self.lock:
+            self.used = max(self.used, used) if int(time.time() // 60) == self.minute else used
+
+    # 收到 429/418 后按 Retry-After 暂停
+    def ban(self, retry_after):
+        with self.lock:
+            self.banned_until = time.time() + retry_after
+        logging.warning(f"请求频率超限，暂停 {retry_after} 秒")
+
+    # 当前分钟已用权重 / 上限，供界面和日志显示
+    def usage(self):
+        with self.lock:
+            used = self.used if int(time.time() // 60) == self.minute else 0
+            return used, self.limit
+
+request_budget = RequestBudget()
+
+# 请求权重调度器：包装 Spot 客户端，每次调用前从共用的请求预算中预留权重
+class WeightBudget:
+    def __init__(self, spot, budget=None):
+        self.spot = spot
+        self.budget = budget or request_budget
+
+    def __getattr__(self, name):
+        attr = getattr(self.spot, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, priority=None, **kwargs):
+            return self.request(name, attr, priority, *args, **kwargs)
+        return call
+
+    def request(self, name, method, priority, *args, **kwargs):
+        if priority is None:
+            priority = REQUEST_PRIORITY.get(name, PRIORITY_NORMAL)
+        self.budget.reserve(name, self.budget.cost(name, kwargs), priority)
+        try:
+            response = method(*args, **kwargs)
+        except ClientError as e:
+            if e.status_code in (418, 429):
+                self.budget.ban(int((e.header or {}).get('Retry-After', 60)))
+            raise
+        if isinstance(response, dict) and 'limit_usage' in response:
+            used = response['limit_usage'].get('x-mbx-used-weight-1m')
+            if used is not None:
+                self.budget.calibrate(int(used))
+            return response['data']
+        return response
+
+# 创建账户的客户端，使用进程共用的请求预算；Spot 底层的 requests 会话复用 keep-alive 连接
+def create_client(api_key, api_secret):
+    spot = WeightBudget(Spot(api_key=api_key, api_secret=api_secret, base_url=API_BASE_URL, show_limit_usage=True))
+    spot.time()
+    return spot
+
 # 初始化 Binance API
 def init_binance(api_key, api_secret):
     global client
     try:
-        client = Spot(api_key=api_key, api_secret=api_secret, base_url='https://api.binance.com')
-        client.time()
+        client = create_client(api_key, api_secret)
         update_queue_put("status_label", "Binance API 初始化成功")
         return True
     except Exception:
         update_queue_put("status_label", "Binance API 初始化失败")
         return False
 
+# 交易所元数据服务：exchange_info 只加载一次，按交易对名索引 LOT_SIZE / PRICE_FILTER / NOTIONAL 规则，
+# 下单数量按 stepSize 整数步长截断并在本地检查最小名义价值；超过 TTL 后在后台低优先级刷新
+class ExchangeMetadata:
+    def __init__(self, ttl=EXCHANGE_INFO_TTL):
+        self.ttl = ttl
+        self.symbols = {}  # symbol -> 交易规则
+        self.missing = set()  # 已确认交易所不存在的交易对
+        self.full = False  # 是否已加载全部交易对
+        self.loaded_at = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def parse(symbol_info):
+        filters = {f['filterType']: f for f in symbol_info.get('filters', [])}
+        lot = filters.get('LOT_SIZE', {})
+        price_filter = filters.get('PRICE_FILTER', {})
+        notional = filters.get('NOTIONAL') or filters.get('MIN_NOTIONAL') or {}
+        return {
+            'symbol': symbol_info['symbol'],
+            'status': symbol_info.get('status', 'TRADING'),
+            'base': symbol_info.get('baseAsset'),
+            'quote': symbol_info.get('quoteAsset'),
+            'step': Decimal(lot.get('stepSize', '0.00000001')),
+            'min_qty': Decimal(lot.get('minQty', '0')),
+            'max_qty': Decimal(lot.get('maxQty', '0')),
+            'tick': Decimal(price_filter.get('tickSize', '0.00000001')),
+            'quote_step': Decimal(1).scaleb(-int(symbol_info.get('quoteAssetPrecision', symbol_info.get('quotePrecision', 8)))),
+            'min_notional': Decimal(notional.get('minNotional', '0')),
+            'min_notional_market': notional.get('applyMinToMarket', notional.get('applyToMarket', True)),
+        }
+
+    # 拉取 exchange_info 并建立索引（传 symbols 时只拉这些交易对并合并），同时按 rateLimits 校准请求权重上限；
+    # 只有覆盖了全部已缓存交易对的加载才更新 loaded_at，只补几个交易对不会让其余过期规则显得新鲜
+    def load(self, symbols=None, priority=PRIORITY_NORMAL):
+        if symbols:
+            response = client.exchange_info(symbols=list(symbols), priority=priority)
+        else:
+            response = client.exchange_info(priority=priority)
+        index = {s['symbol']: self.parse(s) for s in response['symbols']}
+        for rate_limit in response.get('rateLimits', []):
+            if rate_limit['rateLimitType'] == 'REQUEST_WEIGHT' and rate_limit['interval'] == 'MINUTE':
+                request_budget.limit = rate_limit['limit'] // rate_limit.get('intervalNum', 1)
+        with self.lock:
+            if not symbols or self.symbols.keys() <= set(symbols):
+                self.loaded_at = time.time()
+            if symbols:
+                self.symbols.update(index)
+                self.missing.update(set(symbols) - set(index))
+            else:
+                self.symbols = index
+                self.missing = set()
+                self.full = True
+        return response
+
+    # 确保这些交易对的规则已知：缓存未过期且都已确认（存在或不存在）时不发请求；未过期时只拉未知的交易对，
+    # 过期时重新加载全部已缓存的交易对（已全量加载则全量刷新）；含交易所不认识的交易对导致请求报错时退回全量加载
+    def ensure(self, symbols):
+        with self.lock:
+            fresh = self.loaded_at and time.time() - self.loaded_at <= self.ttl
+            unknown = [s for s in symbols if s not in self.symbols and not self.full and s not in self.missing]
+            cached = list(self.symbols)
+        if fresh and not unknown:
+            return
+        if fresh:
+            targets = unknown
+        else:
+            targets = None if self.full else cached + unknown
+        try:
+            self.load(targets)
+        except ClientError:
+            self.load()
+
+    # O(1) 判断交易对是否存在且可交易
+    def supports(self, symbol):
+        with self.lock:
+            info = self.symbols.get(symbol)
+        return info is not None and info['status'] == 'TRADING'
+
+    def _refresh(self):
+        try:
+            self.load(None if self.full else list(self.symbols), PRIORITY_LOW)
+            logging.info(f"交易规则已刷新: {len(self.symbols)} 个交易对")
+        except Exception as e:
+            logging.warning(f"刷新交易规则失败: {e}")
+        finally:
+            self.refreshing = False
+
+    # 取交易对规则；过期时在后台刷新，本次仍返回缓存
+    def get(self, symbol):
+        with self.lock:
+            info = self.symbols.get(symbol)
+            if self.loaded_at and time.time() - self.loaded_at > self.ttl and not self.refreshing:
+                self.refreshing = True
+                threading.Thread(target=self._refresh, daemon=True).start()
+        return info
+
+    # 数量按 stepSize 向下取整到整数步，返回 Decimal
+    def quantize_qty(self, symbol, quantity):
+        step = self.get(symbol)['step']
+        return (Decimal(str(quantity)) // step) * step
+
+    # 计价币金额（quoteOrderQty）按计价精度向下截断，返回 Decimal
+    def quantize_quote(self, symbol, quote_qty):
+        step = self.get(symbol)['quote_step']
+        return (Decimal(str(quote_qty)) // step) * step
+
+    # 价格按 tickSize 取整到整数跳动，返回 Decimal
+    def quantize_price(self, symbol, price, rounding=ROUND_DOWN):
+        tick = self.get(symbol)['tick']
+        return (Decimal(str(price)) / tick).to_integral_value(rounding=rounding) * tick
+
+    # 本地检查数量与最小名义价值，返回 (是否通过, 原因)
+    def check_order(self, symbol, quantity, price, order_type='MARKET'):
+        info = self.get(symbol)
+        if info is None:
+            return False, f"未找到 {symbol} 交易规则"
+        if info['status'] != 'TRADING':
+            return False, f"{symbol} 当前状态 {info['status']}"
+        if quantity < info['min_qty']:
+            return False, f"数量 {quantity} 小于最小交易量 {info['min_qty']}"
+        if info['max_qty'] and quantity > info['max_qty']:
+            return False, f"数量 {quantity} 大于最大交易量 {info['max_qty']}"
+        if price and (order_type != 'MARKET' or info['min_notional_market']):
+            notional = quantity * Decimal(str(price))
+            if notional < info['min_notional']:
+                return False, f"名义价值 {notional:.4f} 小于最小值 {info['min_notional']}"
+        return True, ""
+
+    # 按计价币金额下市价买单前的本地检查：金额不低于最小名义价值，按参考价折算的数量不低于最小交易量
+    def check_quote_order(self, symbol, quote_qty, price=None):
+        info = self.get(symbol)
+        if info is None:
+            return False, f"未找到 {symbol} 交易规则"
+        if info['status'] != 'TRADING':
+            return False, f"{symbol} 当前状态 {info['status']}"
+        if quote_qty <= 0:
+            return False, f"金额 {quote_qty} 无效"
+        if info['min_notional_market'] and quote_qty < info['min_notional']:
+            return False, f"金额 {quote_qty} 小于最小名义价值 {info['min_notional']}"
+        if price and quote_qty / Decimal(str(price)) < info['min_qty']:
+            return False, f"按价格 {price} 可得数量小于最小交易量 {info['min_qty']}"
+        return True, ""
+
+exchange_metadata = ExchangeMetadata()
+
 # 验证交易对
 def validate_pairs(pairs):
     try:
-        response = client.exchange_info()
+        exchange_metadata.ensure([pair.replace('/', '') for pair in pairs])
         valid_pairs = []
         for pair in pairs:
             symbol = pair.replace('/', '')
             base_coin = pair.split('/')[0]
-            if any(s['symbol'] == symbol for s in response['symbols']) and base_coin in ALL_COINS:
+            if exchange_metadata.supports(symbol) and base_coin in ALL_COINS:
                 valid_pairs.append(pair)
                 update_queue_put("status_label", f"交易对 {pair} 验证通过")
             else:
@@ -101,233 +478,1931 @@ def validate_pairs(pairs):
 
 # 获取交易对当前价格
 def get_pair_price(symbol):
+    return get_pair_prices([symbol]).get(symbol)
+
+# 一次 ticker_price 请求获取所有交易对最新价，返回 {pair: price}
+def get_pair_prices(pairs):
     try:
-        ticker = client.ticker_price(symbol=symbol.replace('/', ''))
-        return float(ticker['price'])
+        symbol_to_pair = {pair.replace('/', ''): pair for pair in pairs}
+        tickers = client.ticker_price(symbols=list(symbol_to_pair))
+        return {symbol_to_pair[t['symbol']]: float(t['price']) for t in tickers if t['symbol'] in symbol_to_pair}
     except Exception:
-        return None
+        update_queue_put("status_label", "批量获取价格失败，回退 K 线价格")
+        return {}
+
+
+# 滚动 MA 环形缓冲：固定长度数组保存已收盘K线收盘价并维护窗口累加和，收盘时 O(1) 更新 MA
+class RollingMA:
+    def __init__(self, period, capacity=MA_CAPACITY):
+        self.capacity = max(capacity, period)
+        self.buf = np.zeros(self.capacity, dtype=np.float64)
+        self.period = period
+        self.head = 0  # 下一个写入位置
+        self.count = 0  # 有效数据量，最多 capacity
+        self.window_sum = 0.0
+        self.last_open_time = 0  # 最后一根已收盘K线的开盘时间
+        self.pushes = 0
+
+    def push(self, close, open_time=0):
+        if self.count >= self.period:
+            self.window_sum -= self.buf[(self.head - self.period) % self.capacity]
+        self.buf[self.head] = close
+        self.window_sum += close
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.last_open_time = max(self.last_open_time, open_time)
+        self.pushes += 1
+        if self.pushes % self.capacity == 0:
+            self.resum()  # 定期重算，抵消浮点累计误差
+
+    # 按时间顺序返回最近 n 个收盘价
+    def values(self, n=None):
+        n = self.count if n is None else min(n, self.count)
+        return self.buf[(self.head - n + np.arange(n)) % self.capacity]
+
+    def resum(self):
+        self.window_sum = float(self.values(self.period).sum())
+
+    def set_period(self, period):
+        if period == self.period:
+            return
+        if period > self.capacity:
+            values = self.values()
+            self.capacity = period
+            self.buf = np.zeros(self.capacity, dtype=np.float64)
+            self.buf[:len(values)] = values
+            self.head = len(values) % self.capacity
+        self.period = period
+        self.resum()
+
+    def mean(self):
+        return self.window_sum / self.period if self.count >= self.period else None
+
+# 本地K线库：每个 (交易对, 周期) 一个只追加的二进制文件，读取时用 np.memmap 映射，
+# 重启后无需联网即可计算 MA，离线分析也可直接加载数月历史
+class KlineStore:
+    def __init__(self, root=KLINE_STORE_DIR):
+        self.root = root
+        self.last_open = {}  # (pair, interval) -> 已写入的最后开盘时间
+        self.lock = threading.Lock()
+        self.lock_file = None  # 持有的写锁文件；False 表示另一个进程在写，本进程只读
+
+    def path(self, pair, interval):
+        return os.path.join(self.root, f"{pair.replace('/', '')}_{interval}.bin")
+
+    # 只读映射全部历史，返回 KLINE_DTYPE 结构化数组
+    def load(self, pair, interval):
+        path = self.path(pair, interval)
+        count = os.path.getsize(path) // KLINE_DTYPE.itemsize if os.path.exists(path) else 0
+        if count == 0:
+            return np.zeros(0, dtype=KLINE_DTYPE)
+        return np.memmap(path, dtype=KLINE_DTYPE, mode='r', shape=(count,))
+
+    # 首次写入前截掉崩溃留下的半条记录，并读出最后开盘时间
+    def _last_open_time(self, pair, interval):
+        key = (pair, interval)
+        if key not in self.last_open:
+            path = self.path(pair, interval)
+            last = 0
+            if os.path.exists(path):
+                size = os.path.getsize(path)
+                if size % KLINE_DTYPE.itemsize:
+                    with open(path, 'r+b') as f:
+                        f.truncate(size - size % KLINE_DTYPE.itemsize)
+                data = self.load(pair, interval)
+                if len(data):
+                    last = int(data['open_time'][-1])
+            self.last_open[key] = last
+        return self.last_open[key]
+
+    # 同一目录只允许一个进程写入，否则两边各自追加会写出重复行；拿不到写锁时本进程只读（需持有锁）
+    def _writable(self):
+        if self.lock_file is None:
+            os.makedirs(self.root, exist_ok=True)
+            lock_file = open(os.path.join(self.root, '.lock'), 'a')
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    lock_file = False
+                    logging.warning(f"本地K线库 {self.root} 正由另一个进程写入，本进程只读")
+            self.lock_file = lock_file
+        return bool(self.lock_file)
+
+    # 追加已收盘K线（REST 格式的行），已写入的忽略
+    def append(self, pair, interval, klines):
+        try:
+            with self.lock:
+                if not self._writable():
+                    return
+                last = self._last_open_time(pair, interval)
+                rows = [(int(k[0]),) + tuple(float(v) for v in k[1:6]) for k in klines if k[0] > last]
+                if not rows:
+                    return
+                with open(self.path(pair, interval), 'ab') as f:
+                    f.write(np.array(rows, dtype=KLINE_DTYPE).tobytes())
+                self.last_open[(pair, interval)] = rows[-1][0]
+        except Exception as e:
+            logging.warning(f"写入本地K线库失败 {pair} {interval}: {e}")
+
+# K 线缓存：按 (交易对, 周期) 保存已收盘K线。已收盘部分不可变，只从内存读取（首次从本地K线库预热），
+# 之后只向交易所请求最后一根缓存K线之后的数据（startTime 增量拉取），新收盘的K线同时写入本地K线库
+class KlineCache:
+    def __init__(self, size=KLINE_CACHE_SIZE, store=None):
+        self.size = size
+        self.store = store
+        self.open_times = {}  # (pair, interval) -> 已收盘K线开盘时间
+        self.closes = {}  # (pair, interval) -> 已收盘K线收盘价
+        self.stale = set()  # 推送出现断档、等待 REST 补齐的 (pair, interval)
+        self.lock = threading.Lock()
+
+    # 取出 (开盘时间, 收盘价) 列表，内存中没有时从本地K线库加载（需持有锁）
+    def _series(self, pair, interval):
+        key = (pair, interval)
+        if key not in self.open_times:
+            data = self.store.load(pair, interval)[-self.size:] if self.store else np.zeros(0, dtype=KLINE_DTYPE)
+            self.open_times[key] = data['open_time'].tolist()
+            self.closes[key] = data['close'].tolist()
+        return self.open_times[key], self.closes[key]
+
+    def count(self, pair, interval):
+        with self.lock:
+            return len(self._series(pair, interval)[0])
+
+    # 最近 n 根已收盘K线的 (开盘时间列表, 收盘价列表)
+    def closed(self, pair, interval, n):
+        with self.lock:
+            times, closes = self._series(pair, interval)
+            return times[-n:], closes[-n:]
+
+    # 开盘时间晚于 open_time 的已收盘K线
+    def closed_since(self, pair, interval, open_time):
+        with self.lock:
+            times, closes = self._series(pair, interval)
+            i = bisect.bisect_right(times, open_time)
+            return times[i:], closes[i:]
+
+    # 追加已收盘K线（REST 格式的行），重复或过期的忽略；contiguous 时（推送来源）只接受紧接最后一根的K线，
+    # 出现断档则丢弃并标记该序列待补齐，由下次 sync 用 REST 增量拉取，避免缓存和本地K线库留下空洞
+    def append(self, pair, interval, klines, contiguous=True):
+        step = INTERVAL_MS[interval]
+        with self.lock:
+            key = (pair, interval)
+            times, closes = self._series(pair, interval)
+            added = []
+            for k in klines:
+                if times and k[0] <= times[-1]:
+                    continue
+                if contiguous and times and k[0] != times[-1] + step:
+                    self.stale.add(key)
+                    break
+                times.append(k[0])
+                closes.append(float(k[4]))
+                added.append(k)
+            if not contiguous:
+                self.stale.discard(key)
+            if len(times) > self.size:
+                del times[:-self.size]
+                del closes[:-self.size]
+        if added and self.store:
+            self.store.append(pair, interval, added)
+        return bool(added)
+
+    def replace(self, pair, interval, klines):
+        with self.lock:
+            key = (pair, interval)
+            self.open_times[key] = [k[0] for k in klines][-self.size:]
+            self.closes[key] = [float(k[4]) for k in klines][-self.size:]
+            self.stale.discard(key)
+        if self.store:
+            self.store.append(pair, interval, klines)
+
+    # 按周期边界判断缓存是否缺少已收盘K线：最后一根缓存K线之后的那根还未收盘则无需请求；
+    # grace_ms 为收盘后等待推送送达的宽限时间
+    def is_current(self, pair, interval, count, grace_ms=0):
+        with self.lock:
+            times = self._series(pair, interval)[0]
+            if len(times) < count or (pair, interval) in self.stale:
+                return False
+            step = INTERVAL_MS[interval]
+            return times[-1] + 2 * step + grace_ms > int(time.time() * 1000)
+
+    # 同步请求参数：缓存足够时只拉最后一根之后的增量；首次拉取、缓存不足或 full 时整段拉取。返回 (参数, 是否增量)
+    def sync_params(self, pair, interval, count, full=False):
+        symbol = pair.replace('/', '')
+        with self.lock:
+            times = self._series(pair, interval)[0]
+            last_open = times[-1] if len(times) >= count and not full else None
+        if last_open is not None:
+            return {'symbol': symbol, 'interval': interval, 'startTime': last_open + INTERVAL_MS[interval], 'limit': 1000}, True
+        return {'symbol': symbol, 'interval': interval, 'limit': min(max(count, MA_CAPACITY) + 1, 1000)}, False
+
+    # 写入同步结果并返回当前K线（最后一行，未收盘）的收盘价；增量结果断档过长时返回 None，需整段拉取
+    def sync_apply(self, pair, interval, klines, incremental):
+        if incremental:
+            if len(klines) >= 1000:
+                return None
+            self.append(pair, interval, klines[:-1], contiguous=False)
+        else:
+            self.replace(pair, interval, klines[:-1])
+        return float(klines[-1][4])
 
-# 获取 K 线数据并计算 MA
+    # 补齐缓存并返回当前价
+    def sync(self, pair, interval, count):
+        params, incremental = self.sync_params(pair, interval, count)
+        price = self.sync_apply(pair, interval, client.klines(**params), incremental)
+        if price is None:
+            params, incremental = self.sync_params(pair, interval, count, full=True)
+            price = self.sync_apply(pair, interval, client.klines(**params), incremental)
+        return price
+
+kline_cache = KlineCache(store=KlineStore())
+
+# 用缓存中新收盘的K线推进滚动 MA；缓冲不存在、数据不足或与缓存断档时从缓存重建（无网络请求）
+def rolling_ma(pair, interval, period):
+    with kline_lock:
+        rolling = ma_buffers.get((pair, interval))
+        step = INTERVAL_MS[interval]
+        if rolling is not None and rolling.count >= period:
+            times, closes = kline_cache.closed_since(pair, interval, rolling.last_open_time)
+            if not times or times[0] - rolling.last_open_time <= step:
+                for open_time, close in zip(times, closes):
+                    rolling.push(close, open_time)
+                rolling.set_period(period)
+                return rolling.mean()
+        times, closes = kline_cache.closed(pair, interval, max(period, MA_CAPACITY))
+        rolling = RollingMA(period)
+        for open_time, close in zip(times, closes):
+            rolling.push(close, open_time)
+        ma_buffers[(pair, interval)] = rolling
+        return rolling.mean()
+
+# 获取 K 线数据并计算 MA：已收盘K线来自缓存，每次只增量请求缓存之后的K线
 def get_klines(symbol, interval='4h', limit=31, ma_period=30):
     try:
-        klines = client.klines(symbol=symbol.replace('/', ''), interval=interval, limit=limit)
-        # 仅提取收盘价，避免 DataFrame
-        closes = np.array([float(k[4]) for k in klines[:-1]], dtype=np.float64)
-        # 处理 NaN
-        if np.isnan(closes).any():
-            closes = np.nan_to_num(closes, nan=closes[~np.isnan(closes)][-1])
-        # 计算 MA
-        ma = np.mean(closes[-ma_period:]) if len(closes) >= ma_period else None
-        current_price = float(klines[-1][4])
-        return current_price, ma
+        current_price = kline_cache.sync(symbol, interval, max(limit - 1, ma_period))
+        return current_price, rolling_ma(symbol, interval, ma_period)
     except Exception:
         update_queue_put("status_label", f"获取 {symbol} 数据失败")
         return None, None
 
-# 获取交易对信息
-def get_symbol_info(symbol):
+# K 线聚合器：由基础周期（1m）已收盘K线在本地合成 5m/15m/30m/1h/4h/1d K线
+class CandleAggregator:
+    def __init__(self, base_interval, intervals):
+        self.base_ms = INTERVAL_MS[base_interval]
+        self.intervals = [interval for interval in intervals if INTERVAL_MS[interval] > self.base_ms]
+        self.partial = {}  # (pair, interval) -> [开盘时间, 开, 高, 低, 收, 量, 最后一根基础K线开盘时间, 是否完整]
+
+    # 输入一根已收盘基础K线，返回本次收盘的 [(interval, kline)]；
+    # 中途启动或漏掉基础K线的不完整K线不返回，交给 K 线缓存用 REST 补齐
+    def add(self, pair, kline):
+        open_time = int(kline[0])
+        o, h, l, c, v = (float(x) for x in kline[1:6])
+        finished = []
+        for interval in self.intervals:
+            step = INTERVAL_MS[interval]
+            bucket = open_time - open_time % step
+            key = (pair, interval)
+            candle = self.partial.get(key)
+            if candle is None or candle[0] != bucket:
+                candle = [bucket, o, h, l, c, v, open_time, open_time == bucket]
+                self.partial[key] = candle
+            else:
+                candle[2] = max(candle[2], h)
+                candle[3] = min(candle[3], l)
+                candle[4] = c
+                candle[5] += v
+                candle[7] = candle[7] and open_time == candle[6] + self.base_ms
+                candle[6] = open_time
+            if open_time + self.base_ms == bucket + step:
+                if candle[7]:
+                    finished.append((interval, candle[:6]))
+                del self.partial[key]
+        return finished
+
+# K 线推送引擎：一条组合连接订阅所有交易对的基础周期 <symbol>@kline_1m，内存中保存最新价，
+# 其余周期由聚合器本地合成，切换周期或同时使用多个周期都不增加请求
+class KlineStream:
+    def __init__(self, pairs, interval=BASE_INTERVAL, stream_url=STREAM_URL, ws_factory=SpotWebsocketStreamClient):
+        self.pairs = list(pairs)
+        self.interval = interval
+        self.stream_url = stream_url
+        self.ws_factory = ws_factory  # 便于用本地推送桩替换
+        self.symbol_to_pair = {pair.replace('/', ''): pair for pair in self.pairs}
+        self.aggregator = CandleAggregator(interval, INTERVAL_MS)
+        self.live = {}  # pair -> (开盘时间, 最新价, 接收时间)
+        self.ws_client = None
+        self.connected = False
+
+    # 启动时并发补齐各周期K线缓存（缓存已是最新则不请求），之后完全依赖推送
+    def seed(self):
+        tasks = [(pair, interval) for pair in self.pairs for interval in [self.interval] + self.aggregator.intervals
+                 if not kline_cache.is_current(pair, interval, MA_CAPACITY)]
+        list(market_data_pool.map(lambda task: kline_cache.sync(task[0], task[1], MA_CAPACITY), tasks))
+
+    def start(self):
+        self.seed()
+        self.ws_client = self.ws_factory(
+            stream_url=self.stream_url,
+            on_message=self.on_message,
+            on_open=self.on_open,
+            on_close=self.on_close,
+            on_error=self.on_error,
+            is_combined=True
+        )
+        for pair in self.pairs:
+            self.ws_client.kline(symbol=pair.replace('/', '').lower(), interval=self.interval)
+        self.connected = True
+
+    def stop(self):
+        self.connected = False
+        try:
+            if self.ws_client:
+                self.ws_client.stop()
+        except Exception:
+            pass
+        self.ws_client = None
+
+    def on_open(self, _):
+        self.connected = True
+        logging.info(f"K线推送已连接: {self.stream_url}")
+
+    def on_close(self, _):
+        self.connected = False
+        logging.warning("K线推送连接已关闭")
+
+    def on_error(self, _, error):
+        self.connected = False
+        logging.warning(f"K线推送错误: {error}")
+
+    def on_message(self, _, message):
+        try:
+            data = json.loads(message)
+            data = data.get('data', data)
+            if data.get('e') != 'kline':
+                return
+            pair = self.symbol_to_pair.get(data['s'])
+            k = data['k']
+            if pair is None or k['i'] != self.interval:
+                return
+            close = float(k['c'])
+            if k['x']:
+                kline = [k['t'], k['o'], k['h'], k['l'], k['c'], k['v']]
+                kline_cache.append(pair, self.interval, [kline])
+                for interval, candle in self.aggregator.add(pair, kline):
+                    kline_cache.append(pair, interval, [candle])
+            with kline_lock:
+                self.live[pair] = (k['t'], close, time.time())
+        except Exception as e:
+            logging.warning(f"解析K线推送失败: {e}")
+
+    # 返回 interval 周期的 (最新价, MA)；推送过期返回 (None, None)，该周期缓存缺K线时 MA 为 None
+    def get(self, pair, interval, period):
+        with kline_lock:
+            live = self.live.get(pair)
+        if not self.connected or live is None or time.time() - live[2] > STREAM_STALE_SECONDS:
+            return None, None
+        if not kline_cache.is_current(pair, interval, period, grace_ms=STREAM_CLOSE_GRACE_MS):
+            return live[1], None
+        return live[1], rolling_ma(pair, interval, period)
+
+# 确保推送引擎与当前交易对一致，断线或交易对变更时重建
+def ensure_kline_stream():
+    global kline_stream
+    stream = kline_stream
+    if stream and stream.connected and stream.pairs == selected_pairs:
+        return stream
+    if stream:
+        stream.stop()
+    kline_stream = None
+    try:
+        stream = KlineStream(selected_pairs)
+        stream.start()
+        kline_stream = stream
+        update_queue_put("status_label", f"K线推送已启动: {len(selected_pairs)} 个交易对 @ {stream.interval}")
+    except Exception as e:
+        logging.warning(f"启动K线推送失败，回退 REST: {e}")
+    return kline_stream
+
+def stop_kline_stream():
+    global kline_stream
+    if kline_stream:
+        kline_stream.stop()
+    kline_stream = None
+
+# 已有最新价时只在K线收盘后同步缓存计算 MA，否则通过 K 线同时获取价格
+def get_price_and_ma(pair, price=None):
+    if price is None:
+        return get_klines(pair, interval=kline_interval, ma_period=ma_period)
     try:
-        info = client.get_symbol_info(symbol)
-        quantity_precision = info['quantityPrecision']
-        min_qty = float(next(filter(lambda x: x['filterType'] == 'LOT_SIZE', info['filters']))['minQty'])
-        return quantity_precision, min_qty
+        if not kline_cache.is_current(pair, kline_interval, ma_period):
+            kline_cache.sync(pair, kline_interval, ma_period)
+        return price, rolling_ma(pair, kline_interval, ma_period)
     except Exception:
-        return 8, 0.0001
+        update_queue_put("status_label", f"获取 {pair} 数据失败")
+        return None, None
+
+# 价格总线的布局版本与本程序不一致（发布方是其他版本）
+class PriceBusLayoutError(Exception):
+    pass
+
+# 共享内存价格总线：固定布局的 NumPy 结构（头部 + 每交易对一条记录），用 seqlock 保护——
+# 发布方写入前后各把序号加一（写入期间为奇数），读取方在前后两次读到相同的偶数序号时数据完整，否则稍候重试；
+# 重试用尽时按交易对沿用上次读到的完整数据。读取直接访问映射的内存，不加锁；
+# 头部的 layout 记录布局版本，读取方版本不一致时拒绝连接。发布方退出后记录停止更新，超过 max_age 视为失效
+class PriceBus:
+    def __init__(self, name=PRICE_BUS_NAME, writer=False, slots=PRICE_BUS_SLOTS, max_age=REST_REFRESH_SECONDS * 2):
+        size = PRICE_BUS_HEADER.itemsize + slots * PRICE_BUS_RECORD.itemsize
+        self.writer = writer
+        self.max_age = max_age
+        if writer:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:  # 上次发布进程异常退出留下的内存块，直接复用
+                self.shm = shared_memory.SharedMemory(name=name)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # 读取方不负责回收，避免进程退出时 resource_tracker 删除发布方的内存块
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.header = np.ndarray((), dtype=PRICE_BUS_HEADER, buffer=self.shm.buf)
+        self.records = np.ndarray((slots,), dtype=PRICE_BUS_RECORD, buffer=self.shm.buf, offset=PRICE_BUS_HEADER.itemsize)
+        self.index = {}  # pair -> 记录下标
+        self.last = {}  # 读取方：pair -> 上次读到的完整记录 (price, ma, ts)
+        if writer:
+            self.header['seq'] = 0
+            self.header['count'] = 0
+            self.header['layout'] = PRICE_BUS_LAYOUT
+        elif int(self.header['layout']) != PRICE_BUS_LAYOUT:
+            layout = int(self.header['layout'])
+            self.close()
+            raise PriceBusLayoutError(f"价格总线布局版本 {layout}，本程序为 {PRICE_BUS_LAYOUT}")
+
+    # 读取方：交易对下标随发布方新增交易对变化，数量变化时重建（发布方重启后下标可能重排，由 read 校验交易对名）
+    def _refresh_index(self, count):
+        if len(self.index) != count:
+            self.index = {pair.decode(): i for i, pair in enumerate(self.records['pair'][:count])}
+
+    # 发布 {pair: (price, ma)}，缺少价格或 MA 的交易对不更新
+    def publish(self, data, interval, period):
+        header = self.header
+        now = int(time.time() * 1000)
+        header['seq'] += 1
+        try:
+            for pair, (price, ma) in data.items():
+                if not (price and ma):
+                    continue
+                i = self.index.get(pair)
+                if i is None:
+                    i = len(self.index)
+                    if i >= len(self.records):
+                        continue
+                    self.records['pair'][i] = pair.encode()
+                    self.index[pair] = i
+                    header['count'] = i + 1
+                self.records['price'][i] = price
+                self.records['ma'][i] = ma
+                self.records['ts'][i] = now
+            header['interval_ms'] = INTERVAL_MS[interval]
+            header['ma_period'] = period
+            header['updated'] = now
+        finally:
+            header['seq'] += 1
+
+    # 读取 {pair: (price, ma)}：只返回 K线周期和 MA 周期一致且未过期的交易对
+    def read(self, pairs, interval, period):
+        header = self.header
+        if int(header['layout']) != PRICE_BUS_LAYOUT:  # 发布方换成了其他版本
+            return {}
+        for attempt in range(PRICE_BUS_READ_RETRIES):
+            if attempt:
+                time.sleep(PRICE_BUS_RETRY_SLEEP)
+            seq = int(header['seq'])
+            if seq & 1:
+                continue
+            if int(header['interval_ms']) != INTERVAL_MS[interval] or int(header['ma_period']) != period:
+                self.last = {}
+                return {}
+            self._refresh_index(int(header['count']))
+            slots = [(pair, self.index[pair]) for pair in pairs if pair in self.index]
+            values = [(pair, float(self.records['price'][i]), float(self.records['ma'][i]), int(self.records['ts'][i]))
+                      for pair, i in slots]
+            moved = any(self.records['pair'][i].decode() != pair for pair, i in slots)
+            if int(header['seq']) == seq:
+                if not moved:
+                    break
+                self.index = {}  # 发布方重启后按新顺序分配了下标，重建后重读
+        else:
+            values = []  # 发布方一直在写入：本轮不更新，沿用上次的完整数据
+        for pair, price, ma, ts in values:
+            self.last[pair] = (price, ma, ts)
+        oldest = int(time.time() * 1000) - self.max_age * 1000
+        return {pair: self.last[pair][:2] for pair in pairs if pair in self.last and self.last[pair][2] >= oldest}
+
+    # 发布方是否仍在更新（读取方据此决定是否自己订阅行情）
+    def live(self, interval, period):
+        return (int(self.header['layout']) == PRICE_BUS_LAYOUT
+                and int(self.header['updated']) >= int(time.time() * 1000) - self.max_age * 1000
+                and int(self.header['interval_ms']) == INTERVAL_MS[interval] and int(self.header['ma_period']) == period)
+
+    def close(self):
+        self.header = self.records = None
+        self.shm.close()
+        if self.writer:
+            self.shm.unlink()
 
-# 下单函数
-def place_order(symbol, side, quantity):
+price_bus = None  # 价格总线（发布方或读取方），未启用时为 None
+price_bus_role = None  # 配置中的 price_bus：publish / read
+
+# 按角色打开价格总线：publish 为发布方，read 为读取方；读取方在发布方尚未启动时返回 None，下一轮再试
+def open_price_bus(role, name=PRICE_BUS_NAME):
+    global price_bus
+    if price_bus is None and role in ('publish', 'read'):
+        try:
+            price_bus = PriceBus(name, writer=role == 'publish')
+            update_queue_put("status_label", "价格总线已启动" if price_bus.writer else "已连接价格总线")
+        except FileNotFoundError:
+            pass
+        except PriceBusLayoutError as e:
+            update_queue_put("status_label", f"价格总线版本不一致，改用自身行情: {e}")
+    return price_bus
+
+# 先取价格总线和推送中已有的价格与MA，返回 (结果, 仍需 REST 获取的交易对)
+def stream_market_data(pairs):
+    results = {}
+    pending = []
+    stream = kline_stream
+    bus = price_bus
+    if bus and not bus.writer:
+        results = bus.read(pairs, kline_interval, ma_period)
+    for pair in pairs:
+        if pair in results:
+            continue
+        price, ma = stream.get(pair, kline_interval, ma_period) if stream else (None, None)
+        if price and ma:
+            results[pair] = (price, ma)
+        else:
+            pending.append(pair)
+    return results, pending
+
+# 获取所有交易对的价格与MA：优先使用推送数据；其余交易对用一次批量 ticker 取价，
+# 再用线程池并发补齐 MA，耗时约为最慢交易对而非总和；截止时间内未返回的交易对结果为 (None, None)
+def fetch_market_data(pairs, deadline=MARKET_DATA_DEADLINE):
+    results, pending = stream_market_data(pairs)
+    if not pending:
+        return results
+    prices = get_pair_prices(pending)
+    futures = {market_data_pool.submit(get_price_and_ma, pair, prices.get(pair)): pair for pair in pending}
+    done, not_done = wait(futures, timeout=deadline)
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception:
+            results[futures[future]] = (None, None)
+    for future in not_done:
+        update_queue_put("status_label", f"获取 {futures[future]} 数据超时，本轮跳过")
+        results[futures[future]] = (None, None)
+    return results
+
+# 向量化信号引擎：价格与 MA 按交易对编号对齐成数组，一次计算偏离、阈值掩码、交易速度档位和排序
+class SignalEngine:
+    def __init__(self, pairs=()):
+        self.set_pairs(pairs)
+
+    def set_pairs(self, pairs):
+        self.pairs = list(pairs)
+        self.base_coins = np.array([pair.split('/')[0] for pair in self.pairs], dtype=object)
+        self.prices = np.zeros(len(self.pairs), dtype=np.float64)
+        self.mas = np.zeros(len(self.pairs), dtype=np.float64)
+
+    # 从价格/MA 字典装载数组，缺失的记为 0（视为无数据）
+    def load(self, pairs, prices, mas):
+        if list(pairs) != self.pairs:
+            self.set_pairs(pairs)
+        n = len(self.pairs)
+        self.prices[:] = np.fromiter((prices.get(pair) or 0.0 for pair in self.pairs), dtype=np.float64, count=n)
+        self.mas[:] = np.fromiter((mas.get(pair) or 0.0 for pair in self.pairs), dtype=np.float64, count=n)
+
+    # 返回 (高于MA币种, 低于MA币种, 交易速度, 偏离不足的交易对)，币种按偏离从大到小排序
+    def compute(self, threshold, speed):
+        valid = (self.prices > 0) & (self.mas > 0)
+        deviation = np.divide(self.prices - self.mas, self.mas, out=np.zeros_like(self.prices), where=valid)
+        abs_dev = np.abs(deviation)
+        active = valid & (abs_dev > threshold)
+        speeds = np.where(abs_dev > FAST_DEVIATION, FAST_TRADE_SPEED, speed)
+        order = np.argsort(-abs_dev, kind='stable')
+        above = order[(active & (deviation > 0))[order]]
+        below = order[(active & (deviation < 0))[order]]
+        trade_speeds = dict(zip(self.base_coins[active], speeds[active].tolist()))
+        skipped = [self.pairs[i] for i in np.flatnonzero(valid & ~active)]
+        return self.base_coins[above].tolist(), self.base_coins[below].tolist(), trade_speeds, skipped
+
+# 市价单参数：数量按缓存的交易规则截断并在本地预检，不再为每笔订单请求交易规则；
+# 传 quote_qty 时按计价币金额（quoteOrderQty）下单，花费金额精确，无需用价格换算数量。预检未通过返回 None
+def order_params(account, symbol, side, quantity=None, price=None, quote_qty=None):
+    pair_symbol = symbol.replace('/', '')
+    if exchange_metadata.get(pair_symbol) is None:
+        update_queue_put("status_label", f"下单失败: 未找到 {symbol} 交易规则")
+        return None
+    price = price or market_state.prices.get(symbol)
+    if quote_qty is not None:
+        quote_qty = exchange_metadata.quantize_quote(pair_symbol, quote_qty)
+        ok, reason = exchange_metadata.check_quote_order(pair_symbol, quote_qty, price)
+        size = {'quoteOrderQty': f"{quote_qty:f}"}
+    else:
+        quantity = exchange_metadata.quantize_qty(pair_symbol, quantity)
+        ok, reason = exchange_metadata.check_order(pair_symbol, quantity, price)
+        size = {'quantity': f"{quantity:f}"}
+    if not ok:
+        update_queue_put("status_label", f"下单失败: {reason}")
+        return None
+    return {
+        'symbol': pair_symbol,
+        'side': side.upper(),
+        'type': 'MARKET',
+        **size,
+        'newClientOrderId': account.journal.intent(pair_symbol, side.upper(), size),
+        'newOrderRespType': 'FULL'  # 返回成交明细和手续费，供本地账本记账
+    }
+
+# 下单函数：订单意图在调用线程写入日志（带上本线程的兑换ID），收到结果后再记一条结果
+def place_order(account, symbol, side, quantity=None, price=None, quote_qty=None):
     try:
-        quantity_precision, min_qty = get_symbol_info(symbol.replace('/', ''))
-        quantity = round(quantity, quantity_precision)
-        if quantity < min_qty:
-            update_queue_put("status_label", f"下单失败: 数量 {quantity} 小于最小交易量 {min_qty}")
+        params = order_params(account, symbol, side, quantity, price, quote_qty)
+        if params is None:
             return None
-        params = {
-            'symbol': symbol.replace('/', ''),
-            'side': side.upper(),
-            'type': 'MARKET',
-            'quantity': f"{quantity:.{quantity_precision}f}"
-        }
-        order = client.new_order(**params)
+        order = account.client.new_order(**params)
+        account.journal.result(params['newClientOrderId'], order)
         return order
     except Exception as e:
+        account.ledger.drift = True  # 下单结果未知（如超时），下次同步时对账
         update_queue_put("status_label", f"下单失败: {str(e)}")
         return None
 
+# 本地账本：按 FULL 下单响应中的成交量和手续费直接更新内存余额，交易后不再查询账户；
+# 按较长间隔或检测到漂移（缺少成交明细、余额为负、下单结果未知）时再与交易所对账
+class BalanceLedger:
+    def __init__(self, tolerance=LEDGER_DRIFT_TOLERANCE):
+        self.state = BalanceSnapshot(free={coin: 0.0 for coin in ALL_COINS})  # 当前余额快照，读取方直接取用
+        self.lock = threading.Lock()  # 只串行化写入方
+        self.tolerance = tolerance
+        self.reconciled_at = 0
+        self.pushed_at = 0  # 最近一次用户数据流账户推送的更新时间（毫秒）
+        self.drift = False
+        self.applied = 0  # 已记账的订单数
+        self.pending = None  # 批量模式下暂存的订单，commit 时一次记账
+        self.pending_lock = threading.Lock()
+
+    # 进入批量模式：之后的订单先暂存
+    def begin(self):
+        with self.pending_lock:
+            self.pending = []
+
+    # 退出批量模式并一次性记账
+    def commit(self):
+        with self.pending_lock:
+            orders, self.pending = self.pending or [], None
+        applied = [order for order in orders if self.apply_order(order)]
+        return len(applied)
+
+    # 订单对各币种余额的影响：买入加基础币、减计价币，卖出相反，再扣手续费
+    @staticmethod
+    def order_deltas(order, base, quote):
+        qty = float(order['executedQty'])
+        quote_qty = float(order['cummulativeQuoteQty'])
+        sign = 1 if order['side'] == 'BUY' else -1
+        deltas = {base: sign * qty, quote: -sign * quote_qty}
+        for fill in order['fills']:
+            asset = fill['commissionAsset']
+            deltas[asset] = deltas.get(asset, 0.0) - float(fill['commission'])
+        return deltas
+
+    # 记账一笔已成交订单；推送已覆盖该订单时跳过，返回是否记账（批量模式下暂存并返回 False）
+    def apply_order(self, order):
+        info = exchange_metadata.get(order.get('symbol', ''))
+        if info is None or 'fills' not in order:
+            self.drift = True
+            return False
+        with self.pending_lock:
+            if self.pending is not None:
+                self.pending.append(order)
+                return False
+        deltas = self.order_deltas(order, info['base'], info['quote'])
+        with self.lock:
+            if order.get('transactTime', 0) and order['transactTime'] <= self.pushed_at:
+                return False
+            free = dict(self.state.free)
+            for coin, delta in deltas.items():
+                if coin in free:
+                    free[coin] += delta
+                    if free[coin] < -self.tolerance:
+                        self.drift = True
+            self.state = self.state.replace(free=free)
+            self.applied += 1
+        self.show()
+        return True
+
+    # 用户数据流推送的是最新可用余额，直接覆盖
+    def observe(self, assets, update_time):
+        with self.lock:
+            free = dict(self.state.free)
+            free.update((asset['a'], float(asset['f'])) for asset in assets if asset['a'] in ALL_COINS)
+            self.state = self.state.replace(free=free)
+            self.pushed_at = max(self.pushed_at, update_time)
+        self.show()
+
+    # 用账户快照对账，记录漂移量
+    def reconcile(self, free):
+        with self.lock:
+            drift = max(abs(self.state.free[coin] - free.get(coin, 0.0)) for coin in ALL_COINS)
+            self.state = self.state.replace(free={coin: free.get(coin, 0.0) for coin in ALL_COINS})
+        if self.reconciled_at and drift > self.tolerance:
+            logging.warning(f"本地账本与交易所余额偏差 {drift:.4f}，已按交易所对账")
+        self.reconciled_at = time.time()
+        self.drift = False
+
+    def show(self):
+        free = self.state.free
+        update_queue_put("balance_label", "\n".join([f"{coin}: {free[coin]:.2f}" for coin in ALL_COINS]))
+
+    def due(self):
+        return self.drift or time.time() - self.reconciled_at >= LEDGER_RECONCILE_SECONDS
+
+class JournalLocked(Exception):
+    pass
+
+# 订单预写日志：每笔订单发出前先以 newClientOrderId 追加写入意图并 fsync，收到结果后再追加一条结果；
+# 多跳兑换另记开始、逐跳完成和结束。进程在两跳之间崩溃时，重启后回放日志，只查询仍在途的订单，
+# 再把停在中间币种的兑换继续做完（做不完则换回原币种），之后压缩日志。
+# 打开日志时加排他锁，同机另一个进程用同一个日志文件时直接报错，不会去恢复或清空别人的在途订单
+class OrderJournal:
+    def __init__(self, path=ORDER_JOURNAL_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.local = threading.local()  # 当前线程正在执行的 (兑换ID, 跳序号)
+        self.seq = itertools.count()
+        self.prefix = f"hsl{os.getpid():x}{int(time.time()):x}"
+        self.file = None
+        self.recovered = False
+
+    # 打开日志并加锁（需持有 self.lock）
+    def _open(self):
+        if self.file is None:
+            file = open(self.path, 'a', encoding='utf-8')
+            if fcntl:
+                try:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    file.close()
+                    raise JournalLocked(f"订单日志 {self.path} 正被另一个进程使用，请为每个进程配置不同的 journal_file")
+            self.file = file
+        return self.file
+
+    def open(self):
+        with self.lock:
+            self._open()
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            file = self._open()
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def new_client_id(self):
+        return f"{self.prefix}x{next(self.seq):x}"  # 不超过 36 个字符
+
+    def begin_swap(self, path, amount):
+        swap_id = self.new_client_id()
+        self.append({'type': 'swap', 'swap': swap_id, 'path': [list(hop) for hop in path], 'amount': amount, 'ts': time.time()})
+        self.local.swap = swap_id
+        self.local.hop = 0
+        return swap_id
+
+    def set_hop(self, hop):
+        self.local.hop = hop
+
+    def hop_done(self, swap_id, hop, delivered):
+        self.append({'type': 'hop', 'swap': swap_id, 'hop': hop, 'delivered': delivered})
+
+    def end_swap(self, swap_id, result):
+        self.append({'type': 'swap_done', 'swap': swap_id, 'result': result})
+        self.local.swap = None
+
+    # 下单意图，返回该订单的 newClientOrderId
+    def intent(self, symbol, side, size):
+        client_order_id = self.new_client_id()
+        self.append({'type': 'intent', 'cid': client_order_id, 'symbol': symbol, 'side': side, 'size': size,
+                     'swap': getattr(self.local, 'swap', None), 'hop': getattr(self.local, 'hop', None)})
+        return client_order_id
+
+    def result(self, client_order_id, response):
+        self.append({'type': 'done', 'cid': client_order_id, 'status': response.get('status'),
+                     'executedQty': response.get('executedQty', '0'),
+                     'cummulativeQuoteQty': response.get('cummulativeQuoteQty', '0')})
+
+    # 回放日志，返回 (未结束的兑换, 仍在途的订单意图, 已有结果的订单意图)
+    def replay(self):
+        swaps, intents, done = {}, {}, {}
+        if not os.path.exists(self.path):
+            return swaps, intents, done
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 崩溃时写了一半的最后一行
+                kind = record['type']
+                if kind == 'swap':
+                    swaps[record['swap']] = dict(record, hops={})
+                elif kind == 'hop' and record['swap'] in swaps:
+                    swaps[record['swap']]['hops'][record['hop']] = record['delivered']
+                elif kind == 'swap_done':
+                    swaps.pop(record['swap'], None)
+                elif kind == 'intent':
+                    intents[record['cid']] = record
+                elif kind == 'done' and record['cid'] in intents:
+                    done[record['cid']] = dict(intents.pop(record['cid']), **record)
+        return swaps, intents, done
+
+    # 订单成交后得到的币种数量（不含手续费）：卖出得计价币，买入得基础币
+    @staticmethod
+    def delivered(intent, state):
+        return float(state['cummulativeQuoteQty'] if intent['side'] == 'SELL' else state['executedQty'])
+
+    # 查询在途订单的最终结果，仍挂着的撤单；交易所查无此单说明请求未到达
+    def resolve(self, spot, intent):
+        try:
+            state = spot.get_order(symbol=intent['symbol'], origClientOrderId=intent['cid'])
+            if state['status'] in ('NEW', 'PARTIALLY_FILLED'):
+                state = spot.cancel_order(symbol=intent['symbol'], origClientOrderId=intent['cid'])
+        except ClientError as e:
+            if e.error_code != -2013:
+                raise
+            state = {'status': 'NOT_FOUND', 'executedQty': '0', 'cummulativeQuoteQty': '0'}
+        self.result(intent['cid'], state)
+        return state
+
+    # 启动时恢复（account 为本日志所属账户）：只查询在途订单，续做或回退停在中间币种的兑换，最后压缩日志；返回处理说明
+    def recover(self, account):
+        self.open()
+        swaps, intents, done = self.replay()
+        notes = []
+        for intent in intents.values():
+            state = self.resolve(account.client, intent)
+            done[intent['cid']] = dict(intent, **state)
+            notes.append(f"在途订单 {intent['cid']} {intent['symbol']} {intent['side']}: {state['status']}")
+        for swap_id, swap in swaps.items():
+            for record in done.values():
+                if record.get('swap') == swap_id and record.get('hop') not in swap['hops']:
+                    progress = swap.setdefault('partial', {})
+                    progress[record['hop']] = progress.get(record['hop'], 0.0) + self.delivered(record, record)
+            hops = {**swap.get('partial', {}), **swap['hops']}
+            path = [tuple(hop) for hop in swap['path']]
+            reached = [hop for hop, delivered in hops.items() if delivered > 0]
+            if not reached or max(reached) == len(path) - 1:
+                self.end_swap(swap_id, 'recovered')
+                continue
+            last = max(reached)
+            coin, amount = path[last][1], hops[last]
+            remaining = path[last + 1:]
+            success, _, reason = execute_route(account, remaining, amount,
+                                               conversion_router.quotes({hop[2] for hop in remaining}))
+            result = 'finished'
+            if not success:
+                back, _, book = conversion_router.best(coin, path[0][0], amount)
+                success = bool(back) and execute_route(account, back, amount, book)[0]
+                result = 'rolled_back' if success else 'stuck'
+            self.end_swap(swap_id, result)
+            notes.append(f"兑换 {swap_id} 停在 {amount:.2f} {coin}: {result}")
+        self.compact()
+        self.recovered = True
+        if notes:
+            account.ledger.drift = True  # 恢复期间的成交未逐笔记账，下次同步时对账
+        return notes
+
+    # 所有记录都已了结，原地清空日志（不替换文件，保留文件锁）
+    def compact(self):
+        with self.lock:
+            file = self._open()
+            os.ftruncate(file.fileno(), 0)
+            os.fsync(file.fileno())
+
+# 兑换路由：用交易规则中两端都是支持币种的交易对建图，按预估到手数量（买一/卖一价、手续费、跳数成本）
+# 选最优路径，有 FDUSD/USDC 这类直接交易对时跨稳定币兑换只需一笔订单
+class ConversionRouter:
+    def __init__(self, coins=ALL_COINS, max_hops=ROUTE_MAX_HOPS):
+        self.coins = coins
+        self.max_hops = max_hops
+        self.graph = {}  # coin -> [(目标币种, 交易对, 方向)]
+        self.built_at = 0
+
+    # 所有可能的稳定币交易对；交易所不认识的会让 ensure 退回全量加载，之后在缓存有效期内不再请求
+    def candidates(self):
+        return [a + b for a in self.coins for b in self.coins if a != b]
+
+    def build(self):
+        exchange_metadata.ensure(self.candidates())
+        if self.graph and self.built_at == exchange_metadata.loaded_at:
+            return self.graph
+        with exchange_metadata.lock:
+            infos = list(exchange_metadata.symbols.values())
+        graph = {coin: [] for coin in self.coins}
+        for info in infos:
+            base, quote = info['base'], info['quote']
+            if info['status'] == 'TRADING' and base in graph and quote in graph:
+                pair = f"{base}/{quote}"
+                graph[base].append((quote, pair, 'SELL'))
+                graph[quote].append((base, pair, 'BUY'))
+        self.graph = graph
+        self.built_at = exchange_metadata.loaded_at
+        return graph
+
+    # 不超过 max_hops 跳、不重复经过币种的全部路径，每跳为 (卖出币种, 得到币种, 交易对, 方向)
+    def paths(self, from_coin, to_coin):
+        graph = self.build()
+        found = []
+        stack = [(from_coin, [])]
+        while stack:
+            coin, path = stack.pop()
+            visited = {from_coin} | {hop[1] for hop in path}
+            for next_coin, pair, side in graph.get(coin, []):
+                if next_coin in visited:
+                    continue
+                hop = (coin, next_coin, pair, side)
+                if next_coin == to_coin:
+                    found.append(path + [hop])
+                elif len(path) + 1 < self.max_hops:
+                    stack.append((next_coin, path + [hop]))
+        return found
+
+    # 一次请求取所有候选交易对的买一/卖一价
+    def quotes(self, pairs):
+        response = client.book_ticker(symbols=[pair.replace('/', '') for pair in pairs])
+        book = {t['symbol']: (float(t['bidPrice']), float(t['askPrice'])) for t in response}
+        return {pair: book[pair.replace('/', '')] for pair in pairs if pair.replace('/', '') in book}
+
+    @staticmethod
+    def fee(pair):
+        return ROUTE_FEE_RATES.get(pair.replace('/', ''), ROUTE_FEE_RATE)
+
+    # 按当前盘口预估一跳的到手数量（扣手续费）
+    @classmethod
+    def hop_output(cls, hop, amount, book):
+        _, _, pair, side = hop
+        bid, ask = book[pair]
+        if side == 'SELL':
+            amount *= bid
+        else:
+            amount = amount / ask if ask > 0 else 0.0
+        return amount * (1 - cls.fee(pair))
+
+    # 预估整条路径到手数量，每跳另扣跳数成本
+    def estimate(self, path, amount, book):
+        for hop in path:
+            amount = self.hop_output(hop, amount, book) * (1 - ROUTE_HOP_PENALTY)
+        return amount
+
+    # 返回 (最优路径, 预估到手数量, 盘口)；同等到手数量时跳数少者优先
+    def best(self, from_coin, to_coin, amount):
+        paths = self.paths(from_coin, to_coin)
+        if not paths:
+            return None, 0.0, {}
+        book = self.quotes({hop[2] for path in paths for hop in path})
+        priced = [(self.estimate(path, amount, book), -len(path), path)
+                  for path in paths if all(hop[2] in book for hop in path)]
+        if not priced:
+            return None, 0.0, book
+        estimate, _, path = max(priced, key=lambda item: (item[0], item[1]))
+        return path, estimate, book
+
+conversion_router = ConversionRouter()
+
+# 挂单执行引擎：在己方最优价（买一/卖一）挂 LIMIT_MAKER 只做 maker，通过用户数据流 executionReport
+# （流不可用时轮询订单状态）跟踪成交；超过账户的 maker_replace_seconds 未成交则撤单按新盘口重挂，
+# 超过 maker_deadline_seconds（或因会立即成交被拒超过 maker_max_reposts 次）后剩余部分改用市价单。
+# 返回与 FULL 市价单响应同格式的合并结果，账本无需区分。回报和统计由用户数据流线程与下单线程池共同访问，均在锁内读写
+class MakerExecutor:
+    FINAL_STATUSES = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED', 'EXPIRED_IN_MATCH')
+
+    def __init__(self, account):
+        self.account = account  # 下单所用的客户端、订单日志、账本、用户数据流和挂单设置
+        self.reports = {}  # clientOrderId -> executionReport 列表，只保存跟踪中的订单
+        self.events = {}  # clientOrderId -> 有新回报时置位；下单前登记，汇总成交后移除
+        self.lock = threading.Lock()
+        self.stats = {'swaps': 0, 'orders': 0, 'replaced': 0, 'fallbacks': 0,
+                      'target': 0.0, 'maker_filled': 0.0, 'latency': 0.0}
+
+    # 累加统计
+    def record(self, **deltas):
+        with self.lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    # 下单前登记订单，之后到达的回报才会保存
+    def track(self, client_order_id):
+        with self.lock:
+            self.events[client_order_id] = threading.Event()
+
+    # 结束跟踪并丢弃已保存的回报
+    def untrack(self, client_order_id):
+        with self.lock:
+            self.reports.pop(client_order_id, None)
+            self.events.pop(client_order_id, None)
+
+    # 用户数据流 executionReport 回调；不在跟踪中的订单（已汇总或其他来源）的回报直接丢弃
+    def on_execution_report(self, report):
+        with self.lock:
+            event = self.events.get(report['c'])
+            if event:
+                self.reports.setdefault(report['c'], []).append(report)
+        if event:
+            event.set()
+
+    # 用户数据流回报中的最新状态、逐笔手续费和最后一笔成交的交易所时间
+    def stream_state(self, client_order_id):
+        with self.lock:
+            reports = list(self.reports.get(client_order_id, []))
+        if not reports:
+            return None
+        last = reports[-1]
+        trades = [r for r in reports if r.get('x') == 'TRADE']
+        fills = [{'commission': r['n'], 'commissionAsset': r['N']} for r in trades if r.get('N')]
+        return {'status': last['X'], 'executedQty': last['z'], 'cummulativeQuoteQty': last['Z'], 'fills': fills,
+                'transactTime': max((int(r.get('T', 0)) for r in trades), default=0)}
+
+    # 等待订单终结或超时，返回最新状态；用户数据流在线时不发请求
+    def wait_fill(self, symbol, order, timeout):
+        client_order_id = order['clientOrderId']
+        with self.lock:
+            event = self.events[client_order_id]
+        deadline = time.time() + timeout
+        state = None
+        while True:
+            stream = self.account.user_stream
+            if stream and stream.connected:
+                state = self.stream_state(client_order_id) or state
+            else:
+                state = self.account.client.get_order(symbol=symbol, orderId=order['orderId'])
+            remaining = deadline - time.time()
+            if (state and state['status'] in self.FINAL_STATUSES) or remaining <= 0:
+                return state
+            event.wait(min(remaining, MAKER_POLL_SECONDS))
+            event.clear()
+
+    # 撤单并返回最终成交；撤单时订单已成交（-2011）则查询订单
+    def cancel(self, symbol, order):
+        try:
+            state = self.account.client.cancel_order(symbol=symbol, orderId=order['orderId'])
+        except ClientError:
+            state = self.account.client.get_order(symbol=symbol, orderId=order['orderId'])
+        return state
+
+    # 汇总一张挂单的成交并结束跟踪，手续费优先取用户数据流回报，取不到时标记账本漂移等待对账；
+    # 成交时间取回报中的成交时间 T，没有回报时取订单状态中交易所给出的时间
+    def collect(self, order, state):
+        streamed = self.stream_state(order['clientOrderId'])
+        self.untrack(order['clientOrderId'])
+        fills = streamed['fills'] if streamed else []
+        if float(state['executedQty']) > 0 and not fills:
+            self.account.ledger.drift = True
+        fill_time = (streamed or {}).get('transactTime') or state.get('updateTime') or state.get('transactTime') \
+            or order.get('transactTime', 0)
+        return float(state['executedQty']), float(state['cummulativeQuoteQty']), fills, int(fill_time)
+
+    # 卖出按 quantity（基础币数量），买入按 quote_qty（计价币金额）
+    def execute(self, pair, side, quantity=None, quote_qty=None):
+        symbol = pair.replace('/', '')
+        side = side.upper()
+        journal = self.account.journal
+        replace_seconds = self.account.maker_replace_seconds
+        max_reposts = self.account.maker_max_reposts
+        start = time.time()
+        deadline = start + self.account.maker_deadline_seconds
+        remaining = float(quantity if side == 'SELL' else quote_qty)
+        target = remaining
+        filled_qty = filled_quote = 0.0
+        fills = []
+        fill_time = 0  # 最后一笔成交的交易所时间，账本据此判断推送是否已覆盖这些成交
+        last = None
+        reposts = 0
+        while time.time() < deadline and reposts <= max_reposts:
+            bid, ask = conversion_router.quotes([pair])[pair]
+            price = exchange_metadata.quantize_price(symbol, ask if side == 'SELL' else bid)
+            qty = exchange_metadata.quantize_qty(symbol, remaining if side == 'SELL' else remaining / float(price))
+            ok, _ = exchange_metadata.check_order(symbol, qty, price, 'LIMIT_MAKER')
+            if not ok:
+                break
+            client_order_id = journal.intent(symbol, side, {'quantity': f"{qty:f}", 'price': f"{price:f}"})
+            self.track(client_order_id)  # 回报可能早于下单响应到达
+            try:
+                order = self.account.client.new_order(symbol=symbol, side=side, type='LIMIT_MAKER', quantity=f"{qty:f}",
+                                         price=f"{price:f}", newClientOrderId=client_order_id, newOrderRespType='FULL')
+            except ClientError as e:
+                self.untrack(client_order_id)
+                journal.result(client_order_id, {'status': 'REJECTED'})
+                # -2010 也用于余额不足等拒单，只有"会立即成交"才稍等后按新盘口重挂，其余直接抛出
+                if e.error_code == -2010 and 'immediately match' in str(e.error_message):
+                    reposts += 1
+                    time.sleep(MAKER_REPOST_BACKOFF)
+                    continue
+                raise
+            self.record(orders=1)
+            state = self.wait_fill(symbol, order, min(replace_seconds, max(deadline - time.time(), 0)))
+            if not state or state['status'] not in self.FINAL_STATUSES:
+                state = self.cancel(symbol, order)
+                self.record(replaced=1)
+            journal.result(client_order_id, state)
+            executed, executed_quote, order_fills, order_time = self.collect(order, state)
+            filled_qty += executed
+            filled_quote += executed_quote
+            fills += order_fills
+            if executed > 0:
+                fill_time = max(fill_time, order_time)
+            remaining -= executed if side == 'SELL' else executed_quote
+            last = order
+            if state['status'] == 'FILLED' and executed > 0:
+                break
+        self.record(swaps=1, target=target, maker_filled=target - max(remaining, 0.0))
+        market = None
+        if remaining > 0 and (time.time() >= deadline or reposts > max_reposts):
+            market = place_order(self.account, pair, side.lower(),
+                                 **({'quantity': remaining} if side == 'SELL' else {'quote_qty': remaining}))
+            if market:
+                self.record(fallbacks=1)
+                filled_qty += float(market['executedQty'])
+                filled_quote += float(market['cummulativeQuoteQty'])
+                fills += market.get('fills', [])
+                fill_time = max(fill_time, int(market.get('transactTime', 0)))
+                last = market
+        self.record(latency=time.time() - start)
+        if last is None or filled_qty <= 0:
+            return None
+        return {'symbol': symbol, 'side': side, 'orderId': last['orderId'], 'transactTime': fill_time,
+                'executedQty': f"{filled_qty}", 'cummulativeQuoteQty': f"{filled_quote}", 'fills': fills}
+
+    # 延迟与成交率统计：maker 成交占目标数量的比例、平均每次兑换耗时、撤单重挂和市价兜底次数
+    def summary(self):
+        with self.lock:
+            stats = dict(self.stats)
+        if not stats['swaps']:
+            return "暂无挂单"
+        fill_rate = stats['maker_filled'] / stats['target'] if stats['target'] else 0.0
+        return (f"挂单成交率 {fill_rate:.1%}，平均耗时 {stats['latency'] / stats['swaps']:.1f}s，"
+                f"挂单 {stats['orders']} 次，重挂 {stats['replaced']} 次，市价兜底 {stats['fallbacks']} 次")
+
+# 按账户的下单方式执行一笔订单：MAKER 模式走挂单引擎，否则直接市价
+def submit_order(account, pair, side, quantity=None, price=None, quote_qty=None):
+    if account.execution_mode == 'MAKER':
+        try:
+            return account.maker_executor.execute(pair, side, quantity=quantity, quote_qty=quote_qty)
+        except Exception as e:
+            account.ledger.drift = True
+            update_queue_put("status_label", f"挂单失败: {str(e)}")
+            return None
+    return place_order(account, pair, side, quantity, price, quote_qty)
+
+# 下单前按预估数量逐跳检查交易规则，避免第一跳成交后卡在中间币种
+def check_route(path, amount, book):
+    for hop in path:
+        _, _, pair, side = hop
+        bid, ask = book[pair]
+        symbol = pair.replace('/', '')
+        if side == 'SELL':
+            ok, reason = exchange_metadata.check_order(symbol, exchange_metadata.quantize_qty(symbol, amount), bid)
+        else:
+            ok, reason = exchange_metadata.check_quote_order(symbol, exchange_metadata.quantize_quote(symbol, amount), ask)
+        if not ok:
+            return False, f"{pair}: {reason}"
+        amount = ConversionRouter.hop_output(hop, amount, book)
+    return True, ""
+
+# 按路径逐跳下单：卖出按数量，买入按计价币金额（quoteOrderQty），每跳以上一跳实际到手数量（扣除手续费）为输入；
+# 返回 (是否成功, 最终数量, 说明)
+def execute_route(account, path, amount, book):
+    ok, reason = check_route(path, amount, book)
+    if not ok:
+        return False, amount, f"预检未通过 {reason}"
+    journal = account.journal
+    swap_id = journal.begin_swap(path, amount)
+    try:
+        for hop, (coin, next_coin, pair, side) in enumerate(path):
+            journal.set_hop(hop)
+            bid, ask = book[pair]
+            if side == 'SELL':
+                order = submit_order(account, pair, 'sell', amount, bid)
+            else:
+                order = submit_order(account, pair, 'buy', price=ask, quote_qty=amount)
+            if not order:
+                if hop == 0:
+                    journal.end_swap(swap_id, 'failed')
+                return False, amount, f"{pair} {side} 失败，持仓停留在 {coin}"
+            account.ledger.apply_order(order)
+            base, quote = pair.split('/')
+            amount = BalanceLedger.order_deltas(order, base, quote).get(next_coin, 0.0)
+            journal.hop_done(swap_id, hop, amount)
+            update_queue_put("status_label", f"兑换成功: {coin} -> {next_coin} ({pair} {side}), 订单ID: {order['orderId']}")
+        journal.end_swap(swap_id, 'done')
+        return True, amount, ""
+    finally:
+        # 停在中间币种（或出错）时保留未结束记录，重启恢复时续做或回退；本线程之后的订单不再带这个兑换ID
+        journal.local.swap = None
+
+# 用账户快照对账并刷新界面（一次遍历账户资产）
+def apply_account(ledger, account_info):
+    ledger.reconcile({asset['asset']: float(asset['free']) for asset in account_info['balances']})
+    ledger.show()
+
 # 更新账户余额
-def update_balances():
-    global balances
+def update_balances(account, priority=PRIORITY_NORMAL):
     try:
-        account = client.account()
-        for coin in ALL_COINS:
-            balance = float(next((asset['free'] for asset in account['balances'] if asset['asset'] == coin), 0.0))
-            with lock:
-                balances[coin] = balance
-        update_queue_put("balance_label", "\n".join([f"{coin}: {balances[coin]:.2f}" for coin in ALL_COINS]))
+        apply_account(account.ledger, account.client.account(priority=priority))
+    except WeightBudgetExceeded:
+        pass
     except Exception:
         update_queue_put("status_label", "更新余额失败")
 
-# 执行交易
-def execute_trade(from_coin, to_coin, amount, prices):
-    global balances
+# 用户数据流余额跟踪：listenKey 订阅 outboundAccountPosition / executionReport，在内存中维护余额快照；
+# 每次（重新）连接后只用一次 account() 对账，之后不再轮询
+class UserDataStream:
+    def __init__(self, account, stream_url=STREAM_URL, ws_factory=SpotWebsocketStreamClient):
+        self.account = account
+        self.ledger = account.ledger  # 账户推送写入的账本
+        self.stream_url = stream_url
+        self.ws_factory = ws_factory  # 便于用本地推送桩替换
+        self.listen_key = None
+        self.ws_client = None
+        self.connected = False
+        self.last_keepalive = 0
+        self.order_handlers = []  # executionReport 回调
+
+    def start(self):
+        self.listen_key = self.account.client.new_listen_key()['listenKey']
+        self.last_keepalive = time.time()
+        self.ws_client = self.ws_factory(
+            stream_url=self.stream_url,
+            on_message=self.on_message,
+            on_open=self.on_open,
+            on_close=self.on_close,
+            on_error=self.on_error,
+            is_combined=True
+        )
+        self.ws_client.user_data(listen_key=self.listen_key)
+        self.connected = True
+        update_balances(self.account)  # 连接后对账一次
+
+    def stop(self):
+        self.connected = False
+        try:
+            if self.ws_client:
+                self.ws_client.stop()
+            if self.listen_key:
+                self.account.client.close_listen_key(self.listen_key)
+        except Exception:
+            pass
+        self.ws_client = None
+        self.listen_key = None
+
+    # listenKey 60 分钟过期，定期续期
+    def keepalive(self):
+        if self.listen_key and time.time() - self.last_keepalive >= LISTEN_KEY_KEEPALIVE:
+            self.account.client.renew_listen_key(self.listen_key)
+            self.last_keepalive = time.time()
+
+    def on_open(self, _):
+        self.connected = True
+        logging.info("用户数据流已连接")
+
+    def on_close(self, _):
+        self.connected = False
+        logging.warning("用户数据流连接已关闭")
+
+    def on_error(self, _, error):
+        self.connected = False
+        logging.warning(f"用户数据流错误: {error}")
+
+    def on_message(self, _, message):
+        try:
+            data = json.loads(message)
+            data = data.get('data', data)
+            event = data.get('e')
+            if event == 'outboundAccountPosition':
+                self.ledger.observe(data['B'], data.get('u', data.get('E', 0)))
+            elif event == 'executionReport':
+                for handler in self.order_handlers:
+                    handler(data)
+            elif event == 'listenKeyExpired':
+                self.connected = False
+        except Exception as e:
+            logging.warning(f"解析用户数据流失败: {e}")
+
+# 确保账户的用户数据流在线并续期；断线后重连（重连时对账一次）
+def ensure_user_stream(account):
+    stream = account.user_stream
+    if stream and stream.connected:
+        stream.keepalive()
+        return stream
+    if stream:
+        stream.stop()
+    account.user_stream = None
+    try:
+        stream = UserDataStream(account)
+        stream.order_handlers.append(account.maker_executor.on_execution_report)
+        stream.start()
+        account.user_stream = stream
+        update_queue_put("status_label", "用户数据流已启动，余额改为推送更新")
+    except Exception as e:
+        logging.warning(f"启动用户数据流失败，回退 account() 轮询: {e}")
+    return account.user_stream
+
+def stop_user_stream(account):
+    if account.user_stream:
+        account.user_stream.stop()
+    account.user_stream = None
+
+# 同步余额：成交已由本地账本记账，只在对账到期或检测到漂移时查询账户
+def sync_balances(account, priority=PRIORITY_NORMAL):
+    if account.ledger.due():
+        update_balances(account, priority)
+
+# 按可用余额和交易比例计算卖出数量：取整，不足5枚时尽量补到5枚
+def trade_size(available, speed):
+    amount = int(available * speed)
+    if amount < 5:
+        amount = 5 if available >= 5 else int(available)
+    return amount
+
+# 执行一笔兑换；amount 为卖出的 from_coin 数量（由净额规划器按余额预留），route 为规划好的 (路径, 盘口)
+def execute_trade(account, from_coin, to_coin, amount, prices, route=None):
     if from_coin == to_coin:
         return False, f"无效交易: {from_coin} -> {to_coin}"
     if from_coin not in ALL_COINS or to_coin not in ALL_COINS:
         return False, f"币种不支持: {from_coin} 或 {to_coin} 不在支持列表中"
-
-    amount = balances[from_coin] * trade_speed
-    amount = int(amount)
-    if amount < 5:
-        amount = 5 if balances[from_coin] >= 5 else int(balances[from_coin])
     if amount < 5:
-        return False, f"数量不足5枚: {from_coin} (余额: {balances[from_coin]:.2f})"
+        return False, f"数量不足5枚: {from_coin} (数量: {amount:.2f})"
 
     try:
-        if from_coin != 'USDT' and to_coin == 'USDT':
+        if route is None and from_coin != 'USDT' and to_coin == 'USDT':
             pair = f"{from_coin}/USDT"
             if pair not in prices or prices[pair] is None:
                 return False, f"无交易对价格: {pair}"
-            order = place_order(pair, 'sell', amount)
+            order = submit_order(account, pair, 'sell', amount)
             if order:
                 to_amount = float(order['cummulativeQuoteQty'])
                 update_queue_put("status_label", f"卖单成功: {amount:.0f} {from_coin} -> USDT, 订单ID: {order['orderId']}")
-                update_balances()
+                account.ledger.apply_order(order)
                 return True, f"交易成功: {amount:.0f} {from_coin} -> {to_amount:.0f} USDT"
-        elif from_coin == 'USDT' and to_coin != 'USDT':
+        elif route is None and from_coin == 'USDT' and to_coin != 'USDT':
             pair = f"{to_coin}/USDT"
             if pair not in prices or prices[pair] is None:
                 return False, f"无交易对价格: {pair}"
-            to_amount = amount / prices[pair]
-            to_amount = int(to_amount)
-            if to_amount < 5:
-                to_amount = 5 if balances[from_coin] >= 5 * prices[pair] else int(balances[from_coin] / prices[pair])
-            if to_amount < 5:
-                return False, f"目标数量不足5枚: {to_coin} (可得: {to_amount})"
-            order = place_order(pair, 'buy', to_amount)
+            order = submit_order(account, pair, 'buy', price=prices[pair], quote_qty=amount)
             if order:
+                to_amount = float(order['executedQty'])
                 update_queue_put("status_label", f"买单成功: USDT -> {to_amount:.0f} {to_coin}, 订单ID: {order['orderId']}")
-                update_balances()
+                account.ledger.apply_order(order)
                 return True, f"交易成功: {amount:.0f} USDT -> {to_amount:.0f} {to_coin}"
         else:
-            usdt_pair = f"{from_coin}/USDT"
-            target_pair = f"{to_coin}/USDT"
-            if usdt_pair not in prices or prices[usdt_pair] is None or target_pair not in prices or prices[target_pair] is None:
-                return False, f"无交易对价格: {usdt_pair} 或 {target_pair}"
-            sell_order = place_order(usdt_pair, 'sell', amount)
-            if not sell_order:
-                return False, f"卖单失败: {from_coin} -> USDT"
-            usdt_amount = float(sell_order['cummulativeQuoteQty'])
-            update_queue_put("status_label", f"卖单成功: {amount:.0f} {from_coin} -> USDT, 订单ID: {sell_order['orderId']}")
-            to_amount = usdt_amount / prices[target_pair]
-            to_amount = int(to_amount)
-            if to_amount < 5:
-                to_amount = 5
-                usdt_amount = to_amount * prices[target_pair]
-                amount = usdt_amount / prices[usdt_pair]
-                amount = int(amount)
-                if amount < 5:
-                    amount = 5 if balances[from_coin] >= 5 else int(balances[from_coin])
-                if amount < 5:
-                    return False, f"数量不足5枚: {from_coin} (需: {amount})"
-                sell_order = place_order(usdt_pair, 'sell', amount)
-                if not sell_order:
-                    return False, f"调整卖单失败: {from_coin} -> USDT"
-                usdt_amount = float(sell_order['cummulativeQuoteQty'])
-                update_queue_put("status_label", f"调整卖单成功: {amount:.0f} {from_coin} -> USDT, 订单ID: {sell_order['orderId']}")
-            buy_order = place_order(target_pair, 'buy', to_amount)
-            if buy_order:
-                update_queue_put("status_label", f"买单成功: USDT -> {to_amount:.0f} {to_coin}, 订单ID: {buy_order['orderId']}")
-                update_balances()
-                return True, f"交易成功: {amount:.0f} {from_coin} -> {to_amount:.0f} {to_coin}"
+            if route is None:
+                path, estimate, book = conversion_router.best(from_coin, to_coin, amount)
+            else:
+                path, book = route
+                estimate = conversion_router.estimate(path, amount, book)
+            if not path:
+                return False, f"无可用兑换路径: {from_coin} -> {to_coin}"
+            route = " -> ".join([from_coin] + [hop[1] for hop in path])
+            success, to_amount, reason = execute_route(account, path, amount, book)
+            if not success:
+                return False, f"兑换失败: {reason}（路径 {route}）"
+            return True, f"交易成功: {amount:.0f} {from_coin} -> {to_amount:.2f} {to_coin}（路径 {route}，预估 {estimate:.2f}）"
         return False, "交易失败"
     except Exception as e:
         return False, f"交易失败: {str(e)} - 堆栈: {traceback.format_exc()}"
 
-# 主交易循环
-def trading_loop():
-    global running, animation_frame, last_trade_time
-    interval_seconds = 5
+# 净额规划器：先按原有规则（高于MA的币种换成偏离最大的低于MA币种或 USDT，USDT 依次买入各低于MA币种）
+# 算出本轮每个币种的目标净流量（按 USDT 计价），卖出与买入相互抵消后，再把供给币种到需求币种的匹配
+# 作为运输问题用 Vogel 近似法求解（单位成本为路由预估的手续费、价差和跳数成本），匹配数不超过 供给数+需求数-1。
+# USDT 作为中转节点：经 USDT 的路径拆成"卖出 -> USDT"和"USDT -> 买入"两段，再按 (卖出币种, 买入币种) 合并，
+# 同一交易对同一方向本轮只下一笔订单；订单数不超过 供给数+需求数-1 加上经 USDT 中转的匹配数
+class RebalancePlanner:
+    def __init__(self, router, min_value=5):
+        self.router = router
+        self.min_value = min_value  # 小于该价值（USDT）的匹配不下单
 
-    while running:
-        try:
-            # 更新价格和MA
-            for pair in selected_pairs:
-                base_coin = pair.split('/')[0]
-                if base_coin not in ALL_COINS:
-                    update_queue_put("status_label", f"跳过 {pair}：基础币种 {base_coin} 不在支持列表")
+    @staticmethod
+    def value(coin, prices):
+        return 1.0 if coin == 'USDT' else prices.get(f"{coin}/USDT") or 0.0
+
+    # 各币种的目标净流量（USDT 计价），卖出为负、买入为正；speed 为交易比例
+    def net_flows(self, above_ma_coins, below_ma_coins, prices, available, speed):
+        flows = dict.fromkeys(ALL_COINS, 0.0)
+        for from_coin in above_ma_coins:
+            if from_coin == 'USDT' or not self.value(from_coin, prices):
+                continue
+            to_coin = next(coin for coin in below_ma_coins + ['USDT'] if coin != from_coin)
+            amount = trade_size(available.get(from_coin, 0.0), speed)
+            if amount >= 5:
+                flows[from_coin] -= amount * self.value(from_coin, prices)
+                flows[to_coin] += amount * self.value(from_coin, prices)
+        if 'USDT' not in above_ma_coins:
+            remaining = available.get('USDT', 0.0)
+            for to_coin in below_ma_coins:
+                amount = trade_size(remaining, speed)
+                if to_coin == 'USDT' or amount < 5:
                     continue
-                price, ma = get_klines(pair, interval=kline_interval, ma_period=ma_period)
-                if price and ma:
-                    with lock:
-                        current_prices[pair] = price
-                        ma_values[pair] = ma
-                    update_queue_put("price_label", "\n".join([f"{pair}: {current_prices[pair]:.4f}" for pair in selected_pairs]))
-                    update_queue_put("ma_label", "\n".join([f"{pair}: {ma_values[pair]:.4f}" for pair in selected_pairs]))
-                else:
-                    update_queue_put("status_label", f"获取 {pair} 数据失败")
-
-            # 更新余额
-            update_balances()
-
-            # 更新GUI状态
-            animation_frame += 1
-            color = (255, 255, 0) if animation_frame % 20 < 10 else (0, 255, 255)
-            update_queue_put("price_label", None, color)
-            update_queue_put("ma_label", None, color)
-            t_status = (animation_frame % 40) / 40.0
-            r_status = int(255 * t_status)
-            g_status = int(255 * (1 - t_status))
-            b_status = 255
-            update_queue_put("status_label", None, (r_status, g_status, b_status))
-
-            # 交易逻辑
-            now = datetime.now()
-            if last_trade_time is None or (now - last_trade_time).total_seconds() >= trade_cooldown:
-                last_trade_time = now
-                above_ma_coins = []
-                below_ma_coins = []
-                trade_speeds = {}
-                for pair in selected_pairs:
-                    base_coin = pair.split('/')[0]
-                    if base_coin not in ALL_COINS:
-                        update_queue_put("status_label", f"跳过 {pair}：基础币种 {base_coin} 不在支持列表")
-                        continue
-                    price = current_prices.get(pair)
-                    ma = ma_values.get(pair)
-                    if price and ma:
-                        diff_percent = abs(price - ma) / ma
-                        if diff_percent > ma_threshold:
-                            trade_speeds[base_coin] = 0.5 if diff_percent > 0.0005 else trade_speed
-                            if price > ma:
-                                above_ma_coins.append(base_coin)
-                            elif price < ma:
-                                below_ma_coins.append(base_coin)
-                        else:
-                            update_queue_put("status_label", f"{pair} 偏离MA不足 {ma_threshold * 100:.2f}%，跳过")
-                update_queue_put("status_label", f"高于MA: {above_ma_coins}, 低于MA: {below_ma_coins}")
-                for from_coin in above_ma_coins:
-                    if from_coin == 'USDT':
-                        continue
-                    for to_coin in below_ma_coins + ['USDT']:
-                        if to_coin == from_coin:
-                            continue
-                        success, msg = execute_trade(from_coin, to_coin, balances[from_coin], current_prices)
-                        update_queue_put("status_label", msg)
-                        if success:
-                            update_balances()
-                        break
-                if 'USDT' not in above_ma_coins:
-                    for to_coin in below_ma_coins:
-                        if to_coin == 'USDT':
-                            continue
-                        success, msg = execute_trade('USDT', to_coin, balances['USDT'], current_prices)
-                        update_queue_put("status_label", msg)
-                        if success:
-                            update_balances()
-            gc.collect()
+                remaining -= amount
+                flows['USDT'] -= amount
+                flows[to_coin] += amount
+        return flows
+
+    # 单位价值的兑换成本矩阵与对应路径；所有候选路径的盘口一次取回
+    def cost_matrix(self, sources, sinks, prices):
+        paths = {(src, dst): self.router.paths(src, dst) for src in sources for dst in sinks if src != dst}
+        pairs = {hop[2] for candidates in paths.values() for path in candidates for hop in path}
+        book = self.router.quotes(pairs) if pairs else {}
+        cost = np.full((len(sources), len(sinks)), np.inf)
+        best = {}
+        for (src, dst), candidates in paths.items():
+            i, j = sources.index(src), sinks.index(dst)
+            for path in candidates:
+                if not all(hop[2] in book for hop in path):
+                    continue
+                out = self.router.estimate(path, 1.0 / self.value(src, prices), book) * self.value(dst, prices)
+                if 1.0 - out < cost[i, j] or (1.0 - out == cost[i, j] and len(path) < len(best[src, dst])):
+                    cost[i, j] = 1.0 - out
+                    best[src, dst] = path
+        return cost, best, book
+
+    # Vogel 近似法：每步在"最优与次优成本之差"最大的行或列上取成本最低的格子尽量分配，
+    # 剩余量小于 min_value 的供给或需求不再参与；返回 [(行, 列, 分配量)]
+    @staticmethod
+    def transport(cost, supply, demand, min_value):
+        supply = supply.astype(np.float64)
+        demand = demand.astype(np.float64)
+        allocations = []
+        while True:
+            active = (supply >= min_value)[:, None] & (demand >= min_value)[None, :]
+            masked = np.where(active, cost, np.inf)
+            if not np.isfinite(masked).any():
+                return allocations
+            penalties = []
+            for matrix in (masked, masked.T):
+                ranked = np.sort(np.hstack([matrix, np.full((matrix.shape[0], 1), np.inf)]), axis=1)
+                penalties.append(np.subtract(ranked[:, 1], ranked[:, 0], out=np.full(len(ranked), -1.0),
+                                             where=np.isfinite(ranked[:, 0])))
+            k = int(np.argmax(np.concatenate(penalties)))
+            if k < len(supply):
+                i, j = k, int(np.argmin(masked[k]))
+            else:
+                i, j = int(np.argmin(masked[:, k - len(supply)])), k - len(supply)
+            matched = min(supply[i], demand[j])
+            supply[i] -= matched
+            demand[j] -= matched
+            allocations.append((i, j, matched))
+
+    # 路径在中途经过 USDT 处拆开，返回各段路径
+    @staticmethod
+    def split_at_usdt(path):
+        legs, start = [], 0
+        for k, hop in enumerate(path[:-1]):
+            if hop[1] == 'USDT':
+                legs.append(path[start:k + 1])
+                start = k + 1
+        return legs + [path[start:]]
+
+    # 单位价值的兑换成本
+    def leg_cost(self, path, prices, book):
+        src, dst = path[0][0], path[-1][1]
+        return 1.0 - self.router.estimate(path, 1.0 / self.value(src, prices), book) * self.value(dst, prices)
+
+    # 按账户余额和交易比例返回订单计划 [(from_coin, to_coin, 卖出数量, (路径, 盘口), 单位成本)]
+    def plan(self, account, above_ma_coins, below_ma_coins, prices):
+        flows = self.net_flows(above_ma_coins, below_ma_coins, prices, account.ledger.state.free, account.trade_speed)
+        sources = [coin for coin, flow in flows.items() if flow <= -self.min_value]
+        sinks = [coin for coin, flow in flows.items() if flow >= self.min_value]
+        if not sources or not sinks:
+            return []
+        supply = np.array([-flows[coin] for coin in sources])
+        demand = np.array([flows[coin] for coin in sinks])
+        cost, best, book = self.cost_matrix(sources, sinks, prices)
+        legs = {}  # (from_coin, to_coin) -> [卖出数量, 路径]
+        for i, j, matched in self.transport(cost, supply, demand, self.min_value):
+            amount = matched / self.value(sources[i], prices)
+            for path in self.split_at_usdt(best[sources[i], sinks[j]]):
+                leg = legs.setdefault((path[0][0], path[-1][1]), [0.0, path])
+                leg[0] += amount
+                if leg[1] != path and self.leg_cost(path, prices, book) < self.leg_cost(leg[1], prices, book):
+                    leg[1] = path
+                amount = self.router.estimate(path, amount, book)  # 下一段只动用本段预估到手的 USDT
+        orders = []
+        for (src, dst), (amount, path) in legs.items():
+            if amount * self.value(src, prices) >= self.min_value:
+                orders.append((src, dst, amount, (path, book), self.leg_cost(path, prices, book)))
+        return orders
+
+    # 订单计划的文字说明及预估总成本（USDT），供模拟运行查看
+    def describe(self, orders, prices):
+        total = sum(amount * self.value(src, prices) * cost for src, _, amount, _, cost in orders)
+        hops = sum(len(route[0]) for _, _, _, route, _ in orders)
+        lines = [f"订单计划: {len(orders)} 笔兑换 / {hops} 笔订单，预估成本 {total:.4f} USDT"]
+        for src, dst, amount, (path, _), cost in orders:
+            pairs = ", ".join(hop[2] for hop in path)
+            lines.append(f"  {amount:.2f} {src} -> {dst}（{pairs}，成本 {cost * 100:.3f}%）")
+        return "\n".join(lines)
+
+rebalance_planner = RebalancePlanner(conversion_router)
+
+# 并发下单：把互不冲突（涉及的非 USDT 币种不重叠）的兑换分批并发提交，每批内各笔并行、批与批之间顺序执行；
+# 用 USDT 买入的兑换排在所有换成 USDT 的兑换之后，中转的 USDT 到账后再买入。
+# 数量已由规划器按余额预留，成交结果汇总后一次性记入账本
+class OrderDispatcher:
+    def __init__(self, account, max_workers=ORDER_WORKERS):
+        self.account = account
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"order_{account.name or 'main'}",
+                                       initializer=set_log_account, initargs=(account.name,))
+
+    # 按涉及的非 USDT 币种分批，同一批内的兑换互不冲突；用 USDT 买入的只进入最后一个产出 USDT 的批次之后
+    @staticmethod
+    def waves(orders):
+        waves = []
+        funded = 0  # 用 USDT 买入的兑换最早可进入的批次
+        for order in sorted(orders, key=lambda order: order[0] == 'USDT'):
+            coins = {order[0], order[1]} - {'USDT'}
+            start = funded if order[0] == 'USDT' else 0
+            for k, (wave, used) in enumerate(waves[start:], start):
+                if not coins & used:
+                    wave.append(order)
+                    used |= coins
+                    break
+            else:
+                k = len(waves)
+                waves.append(([order], set(coins)))
+            if order[1] == 'USDT':
+                funded = max(funded, k + 1)
+        return [wave for wave, _ in waves]
+
+    # 执行订单计划，返回 [((from_coin, to_coin), 是否成功, 说明)]
+    def dispatch(self, orders, prices):
+        results = []
+        ledger = self.account.ledger
+        ledger.begin()
+        try:
+            for wave in self.waves(orders):
+                futures = [self.pool.submit(execute_trade, self.account, from_coin, to_coin, amount, prices, route)
+                           for from_coin, to_coin, amount, route, _ in wave]
+                wait(futures)
+                for (from_coin, to_coin, *_), future in zip(wave, futures):
+                    success, msg = future.result()
+                    results.append(((from_coin, to_coin), success, msg))
+        finally:
+            ledger.commit()
+        return results
+
+# 事件调度器：各任务按下次有用的唤醒时间放入最小堆，线程只在最近的事件到期（或被 wake 唤醒）时运行；
+# 任务函数返回下次到期时间，返回 None 表示不再重复
+class EventScheduler:
+    def __init__(self):
+        self.heap = []  # (到期时间, 序号, 任务名)
+        self.due = {}  # 任务名 -> 当前有效的 (到期时间, 序号)
+        self.tasks = {}
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def add(self, name, func, due):
+        with self.lock:
+            self.tasks[name] = func
+        self.schedule(name, due)
+
+    # 设置（或改期）任务的下次运行时间，旧的堆条目作废
+    def schedule(self, name, due):
+        with self.lock:
+            entry = (due, next(self.seq))
+            self.due[name] = entry
+            heapq.heappush(self.heap, entry + (name,))
+        self.wakeup.set()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def run(self, keep_running):
+        while keep_running():
+            self.wakeup.clear()
+            task = None
+            with self.lock:
+                while self.heap and self.due.get(self.heap[0][2]) != self.heap[0][:2]:
+                    heapq.heappop(self.heap)
+                timeout = self.heap[0][0] - time.time() if self.heap else SCHEDULER_MAX_SLEEP
+                if timeout <= 0:
+                    _, _, name = heapq.heappop(self.heap)
+                    del self.due[name]
+                    task = self.tasks[name]
+            if task is None:
+                self.wakeup.wait(min(timeout, SCHEDULER_MAX_SLEEP))
+                continue
+            next_due = task()
+            with self.lock:
+                rescheduled = name in self.due
+            if next_due is not None and not rescheduled:
+                self.schedule(name, next_due)
+
+trading_scheduler = None  # 行情线程的事件调度器
+
+# 可交易的交易对（基础币种在支持列表内），默认取行情覆盖的全部交易对
+def tradable_pairs(pairs=None):
+    result = []
+    for pair in selected_pairs if pairs is None else pairs:
+        base_coin = pair.split('/')[0]
+        if base_coin not in ALL_COINS:
+            update_queue_put("status_label", f"跳过 {pair}：基础币种 {base_coin} 不在支持列表")
+            continue
+        result.append(pair)
+    return result
+
+# 读取方从价格总线取到行情时不再自己订阅K线推送
+def bus_feeding():
+    bus = open_price_bus(price_bus_role)
+    return bool(bus and not bus.writer and bus.live(kline_interval, ma_period))
+
+# 更新价格和MA
+def refresh_market_data():
+    if not bus_feeding():
+        ensure_kline_stream()
+    pairs = tradable_pairs()
+    market_data = fetch_market_data(pairs)
+    if price_bus and price_bus.writer:
+        price_bus.publish(market_data, kline_interval, ma_period)
+    publish_market_state(market_data)
+
+# 整轮行情合成一个新快照后一次替换，界面文本也由同一快照生成
+def publish_market_state(market_data):
+    global market_state
+    state = market_state
+    prices, mas = dict(state.prices), dict(state.mas)
+    for pair, (price, ma) in market_data.items():
+        if price and ma:
+            prices[pair] = price
+            mas[pair] = ma
+        else:
+            update_queue_put("status_label", f"获取 {pair} 数据失败")
+    state = state.replace(prices=prices, mas=mas)
+    market_state = state
+    update_queue_put("price_label", "\n".join([f"{pair}: {state.prices.get(pair, 0.0):.4f}" for pair in selected_pairs]))
+    update_queue_put("ma_label", "\n".join([f"{pair}: {state.mas.get(pair, 0.0):.4f}" for pair in selected_pairs]))
+
+# 更新GUI状态
+def refresh_ui_status():
+    global animation_frame
+    used, limit = request_budget.usage()
+    update_queue_put("weight_label", f"{used}/{limit} ({used / limit:.1%})，已推迟 {request_budget.deferred} 次")
+    if accounts:
+        update_queue_put("maker_label", "\n".join(f"{account.name}: {account.maker_executor.summary()}" for account in accounts))
+    else:
+        update_queue_put("maker_label", primary_account.maker_executor.summary())
+    animation_frame += 1
+    color = (255, 255, 0) if animation_frame % 20 < 10 else (0, 255, 255)
+    update_queue_put("price_label", None, color)
+    update_queue_put("ma_label", None, color)
+    t_status = (animation_frame % 40) / 40.0
+    r_status = int(255 * t_status)
+    g_status = int(255 * (1 - t_status))
+    b_status = 255
+    update_queue_put("status_label", None, (r_status, g_status, b_status))
+
+# 交易逻辑：按账户自己的交易对、阈值、交易比例和余额规划并下单；
+# 行情快照还缺本账户交易对的价格或 MA（启动后首轮行情未到）时不交易也不进入冷却，返回 False
+def run_trade_logic(account):
+    market = market_state  # 本轮交易只使用这一份行情快照
+    pairs = tradable_pairs(account.selected_pairs)
+    missing = [pair for pair in pairs if not (market.prices.get(pair) and market.mas.get(pair))]
+    if missing:
+        update_queue_put("status_label", f"等待行情: {missing}")
+        return False
+    account.last_trade_time = datetime.now()
+    account.signal_engine.load(pairs, market.prices, market.mas)
+    above_ma_coins, below_ma_coins, trade_speeds, skipped_pairs = account.signal_engine.compute(
+        account.ma_threshold, account.trade_speed)
+    for pair in skipped_pairs:
+        update_queue_put("status_label", f"{pair} 偏离MA不足 {account.ma_threshold * 100:.2f}%，跳过")
+    update_queue_put("status_label", f"高于MA: {above_ma_coins}, 低于MA: {below_ma_coins}")
+    orders = rebalance_planner.plan(account, above_ma_coins, below_ma_coins, market.prices)
+    plan_text = rebalance_planner.describe(orders, market.prices)
+    logging.info(plan_text)
+    update_queue_put("status_label", plan_text)
+    if account.dry_run:
+        return True
+    for _, _, msg in account.dispatcher.dispatch(orders, market.prices):
+        update_queue_put("status_label", msg)
+    return True
+
+# 账户下次交易时间（冷却结束）
+def next_trade_time(account):
+    last = account.last_trade_time
+    return time.time() if last is None else last.timestamp() + account.trade_cooldown
+
+# 当前周期下一根K线收盘后刷新 MA 的时间
+def next_candle_close():
+    step = INTERVAL_MS[kline_interval] / 1000
+    return (time.time() // step + 1) * step + CANDLE_CLOSE_DELAY
+
+# 调度任务包装：捕获异常并写状态栏，失败后按 retry 秒重试
+def scheduled(func, retry=RETRY_SECONDS):
+    def task():
+        try:
+            return func()
         except Exception as e:
             update_queue_put("status_label", f"交易循环错误: {str(e)} - 堆栈: {traceback.format_exc()}")
-        time.sleep(interval_seconds)
+            return time.time() + retry
+    return task
+
+# 推送或价格总线正常时只读内存刷新界面；都不可用时降为低频 REST 轮询
+def market_task():
+    refresh_market_data()
+    refresh_ui_status()
+    stream = kline_stream
+    fresh = (stream and stream.connected) or bus_feeding()
+    return time.time() + (UI_REFRESH_SECONDS if fresh else REST_REFRESH_SECONDS)
+
+def candle_task():
+    refresh_market_data()
+    return next_candle_close()
+
+# 余额由本地账本和用户数据流维护，这里只做低频对账
+def balance_task(account):
+    sync_balances(account, PRIORITY_LOW)
+    return time.time() + BALANCE_REFRESH_SECONDS
+
+def user_stream_task(account):
+    ensure_user_stream(account)
+    return time.time() + USER_STREAM_CHECK_SECONDS
+
+# 交易前同步余额，并让行情线程立即刷新一轮，保证交易逻辑使用最新数据
+def prefetch_task(account):
+    scheduler = trading_scheduler
+    if scheduler:
+        scheduler.schedule('market', time.time())
+    sync_balances(account)
+    return None
+
+def trade_task(account):
+    if not run_trade_logic(account):
+        return time.time() + MARKET_WAIT_SECONDS
+    gc.collect()
+    account.scheduler.schedule('prefetch', next_trade_time(account) - PREFETCH_SECONDS)
+    return next_trade_time(account)
+
+# 设置变更后重新安排K线收盘和各账户的交易时间
+def reschedule_trading():
+    scheduler = trading_scheduler
+    if scheduler:
+        scheduler.schedule('candle', next_candle_close())
+    for account in [primary_account] + accounts:
+        scheduler = account.scheduler
+        if scheduler:
+            scheduler.schedule('trade', next_trade_time(account))
+            scheduler.schedule('prefetch', next_trade_time(account) - PREFETCH_SECONDS)
+
+# 启动时回放账户的订单日志，处理上次退出时在途的订单和兑换
+def recover_journal(account):
+    if not account.journal.recovered:
+        try:
+            for note in account.journal.recover(account):
+                update_queue_put("status_label", f"恢复: {note}")
+        except Exception as e:
+            update_queue_put("status_label", f"订单日志恢复失败: {str(e)}")
+
+# 状态栏消息的账户前缀：账户工作线程和它的下单线程各自设置，不影响其他线程
+log_context = threading.local()
+
+def set_log_account(name):
+    log_context.account = name
+
+# 账户上下文：交易所客户端、账本、订单日志、挂单执行器、下单线程池、用户数据流、冷却时间和交易设置。
+# 各账户函数显式接收账户对象，不切换全局变量；未单独设置的客户端和交易设置沿用全局值
+# （单账户模式的主账户全部沿用，界面保存 API 密钥或设置后立即生效）。K线周期和 MA 周期由共享行情决定，所有账户相同
+class Account:
+    INHERITED = ('client', 'selected_pairs', 'trade_speed', 'ma_threshold', 'trade_cooldown',
+                 'dry_run', 'execution_mode', 'maker_replace_seconds', 'maker_deadline_seconds', 'maker_max_reposts')
+
+    def __init__(self, name=None, journal_file=None):
+        self.name = name
+        self.ledger = BalanceLedger()
+        self.journal = OrderJournal(journal_file or (ORDER_JOURNAL_FILE if name is None else f"order_journal_{name}.jsonl"))
+        self.maker_executor = MakerExecutor(self)
+        self.dispatcher = OrderDispatcher(self)
+        self.signal_engine = SignalEngine()
+        self.user_stream = None
+        self.last_trade_time = None
+        self.scheduler = None  # 账户工作线程的事件调度器
+
+    def __getattr__(self, name):
+        if name in Account.INHERITED:
+            return globals()[name]
+        raise AttributeError(name)
+
+    # 多账户配置：未配置的交易设置取当前全局设置
+    @classmethod
+    def from_config(cls, name, config):
+        account = cls(name, config.get('journal_file'))
+        account.config = config
+        account.client = None
+        account.selected_pairs = config.get('pairs') or list(selected_pairs)
+        account.trade_speed = config.get('trade_speed', trade_speed * 100) / 100
+        account.ma_threshold = config.get('ma_threshold', ma_threshold * 100) / 100
+        account.trade_cooldown = int(config.get('trade_cooldown', trade_cooldown))
+        account.dry_run = bool(config.get('dry_run', dry_run))
+        account.execution_mode = 'MAKER' if config.get('execution_mode', execution_mode) == 'MAKER' else 'MARKET'
+        account.maker_replace_seconds = float(config.get('maker_replace_seconds', maker_replace_seconds))
+        account.maker_deadline_seconds = float(config.get('maker_deadline_seconds', maker_deadline_seconds))
+        account.maker_max_reposts = int(config.get('maker_max_reposts', maker_max_reposts))
+        return account
+
+    # 连接交易所并对账，客户端共用进程的请求预算
+    def connect(self):
+        set_log_account(self.name)
+        try:
+            if not (self.config.get('api_key') and self.config.get('api_secret')):
+                return False
+            self.client = create_client(self.config['api_key'], self.config['api_secret'])
+            update_balances(self)
+            return True
+        except Exception as e:
+            update_queue_put("status_label", f"连接失败: {str(e)}")
+            return False
+        finally:
+            set_log_account(None)
+
+    def snapshot(self):
+        return {
+            'pairs': self.selected_pairs,
+            'balances': dict(self.ledger.state.free),
+            'last_trade_time': self.last_trade_time.isoformat() if self.last_trade_time else None,
+            'dry_run': self.dry_run,
+            'execution_mode': self.execution_mode,
+            'maker': self.maker_executor.summary(),
+        }
+
+primary_account = Account()  # 单账户模式（界面和单账户无界面运行）的账户
+accounts = []  # 多账户模式下的账户列表
+
+# 按配置连接所有账户；共享行情使用第一个账户的客户端，覆盖所有账户交易对的并集
+def start_accounts(configs):
+    global client, selected_pairs
+    for i, config in enumerate(configs):
+        account = Account.from_config(config.get('name') or f"account{i + 1}", config)
+        if not account.connect():
+            logging.error(f"账户 {account.name} 的 API 密钥无效，已跳过")
+            continue
+        if client is None:
+            client = account.client
+        set_log_account(account.name)
+        account.selected_pairs = validate_pairs(account.selected_pairs)
+        set_log_account(None)
+        accounts.append(account)
+    if not accounts:
+        return False
+    pairs = {pair for account in accounts for pair in account.selected_pairs}
+    selected_pairs = [pair for pair in DEFAULT_PAIRS if pair in pairs]
+    return True
+
+# 账户工作线程：每个账户有自己的事件调度器，用户数据流、余额对账、交易前预取和交易只阻塞本账户，
+# 一个账户的挂单兑换耗时再长也不影响行情刷新和其他账户
+def account_loop(account):
+    set_log_account(account.name)
+    scheduler = EventScheduler()
+    account.scheduler = scheduler
+    recover_journal(account)
+    now = time.time()
+    scheduler.add('user_stream', scheduled(lambda: user_stream_task(account)), now)
+    scheduler.add('balances', scheduled(lambda: balance_task(account)), now)
+    scheduler.add('prefetch', scheduled(lambda: prefetch_task(account)), next_trade_time(account) - PREFETCH_SECONDS)
+    scheduler.add('trade', scheduled(lambda: trade_task(account)), next_trade_time(account))
+    scheduler.run(lambda: running)
+    account.scheduler = None
+    stop_user_stream(account)
+
+# 主交易循环：事件驱动，本线程只负责共享行情（界面刷新和K线收盘），每个账户在自己的工作线程里交易；
+# 不传账户时只发布行情（价格总线发布进程）
+def trading_loop(members=None):
+    global trading_scheduler
+    members = [primary_account] if members is None else members
+    scheduler = EventScheduler()
+    trading_scheduler = scheduler
+    workers = [threading.Thread(target=account_loop, args=(account,), name=f"trading_{account.name or 'main'}",
+                                daemon=True) for account in members]
+    for worker in workers:
+        worker.start()
+    now = time.time()
+    scheduler.add('market', scheduled(market_task), now)
+    scheduler.add('candle', scheduled(candle_task), next_candle_close())
+    scheduler.run(lambda: running)
+    for account, worker in zip(members, workers):
+        if account.scheduler:
+            account.scheduler.wake()
+        worker.join()
+    trading_scheduler = None
+    stop_kline_stream()
 
 # 界面更新回调
 last_update = 0
@@ -355,6 +2430,9 @@ def update_ui_callback():
 
 # 辅助函数：安全写入队列
 def update_queue_put(tag, message, color=None):
+    name = getattr(log_context, 'account', None)
+    if name and tag == "status_label" and message is not None:
+        message = f"[{name}] {message}"
     try:
         update_queue.put_nowait((tag, message, color))
     except Queue.Full:
@@ -370,6 +2448,11 @@ def start_trading():
     if not selected_pairs:
         dpg.set_value("status_label", "未选择有效交易对，请至少选择一个交易对")
         return
+    try:
+        primary_account.journal.open()
+    except JournalLocked as e:
+        dpg.set_value("status_label", str(e))
+        return
     running = True
     threading.Thread(target=trading_loop, daemon=True).start()
     dpg.set_value("status_label", "交易已启动")
@@ -378,18 +2461,45 @@ def start_trading():
 def stop_trading():
     global running
     running = False
-    dpg.set_value("status_label", "交易已停止")
+    if trading_scheduler:
+        trading_scheduler.wake()
+    update_queue_put("status_label", "交易已停止")
+
+# 应用交易设置（界面和配置文件共用，比例和阈值单位为 %），缺省项保持当前值；返回按新设置重算的 MA 文本
+def apply_settings(settings):
+    global trade_speed, ma_threshold, ma_period, trade_cooldown, kline_interval, dry_run, execution_mode
+    global maker_replace_seconds, maker_deadline_seconds, maker_max_reposts
+    trade_speed = settings.get('trade_speed', trade_speed * 100) / 100
+    ma_threshold = settings.get('ma_threshold', ma_threshold * 100) / 100
+    ma_period = int(settings.get('ma_period', ma_period))
+    trade_cooldown = int(settings.get('trade_cooldown', trade_cooldown))
+    kline_interval = settings.get('kline_interval', kline_interval)
+    dry_run = bool(settings.get('dry_run', dry_run))
+    execution_mode = 'MAKER' if settings.get('execution_mode', execution_mode) == 'MAKER' else 'MARKET'
+    maker_replace_seconds = float(settings.get('maker_replace_seconds', maker_replace_seconds))
+    maker_deadline_seconds = float(settings.get('maker_deadline_seconds', maker_deadline_seconds))
+    maker_max_reposts = int(settings.get('maker_max_reposts', maker_max_reposts))
+    # 切换周期或 MA 周期时直接用已缓存的K线重新计算，缓存不足的交易对等下一轮补齐
+    ma_text = []
+    for pair in selected_pairs:
+        ma = rolling_ma(pair, kline_interval, ma_period) if kline_cache.count(pair, kline_interval) >= ma_period else None
+        ma_text.append(f"{pair}: {ma:.4f}" if ma else f"{pair}: N/A")
+    reschedule_trading()
+    return "\n".join(ma_text)
 
 # 保存配置
 def save_settings():
-    global trade_speed, ma_threshold, ma_period, trade_cooldown, kline_interval
-    trade_speed = dpg.get_value("trade_speed") / 100
-    ma_threshold = dpg.get_value("ma_threshold") / 100
-    ma_period = int(dpg.get_value("ma_period"))
-    trade_cooldown = int(dpg.get_value("trade_cooldown"))
-    kline_interval = dpg.get_value("kline_interval")
-    dpg.set_value("status_label", "设置已保存")
-    dpg.set_value("ma_label", "\n".join([f"{pair}: N/A" for pair in selected_pairs]))
+    ma_text = apply_settings({
+        'trade_speed': dpg.get_value("trade_speed"),
+        'ma_threshold': dpg.get_value("ma_threshold"),
+        'ma_period': dpg.get_value("ma_period"),
+        'trade_cooldown': dpg.get_value("trade_cooldown"),
+        'kline_interval': dpg.get_value("kline_interval"),
+        'dry_run': dpg.get_value("dry_run"),
+        'execution_mode': 'MAKER' if dpg.get_value("execution_mode") == '只挂单 (LIMIT_MAKER)' else 'MARKET',
+    })
+    dpg.set_value("status_label", "设置已保存（模拟运行）" if dry_run else "设置已保存")
+    dpg.set_value("ma_label", ma_text)
 
 # 保存 API 密钥
 def save_api():
@@ -397,7 +2507,7 @@ def save_api():
     api_secret = dpg.get_value("api_secret")
     if init_binance(api_key, api_secret):
         save_config(api_key, api_secret)
-        update_balances()
+        update_balances(primary_account)
     else:
         dpg.set_value("status_label", "无效的 API 密钥")
 
@@ -448,6 +2558,8 @@ def show_help_window():
         dpg.add_text("   - MA 周期：计算移动平均线的K线数量。")
         dpg.add_text("   - 交易冷却时间（秒）：两次交易之间的间隔。")
         dpg.add_text("   - K线周期：选择MA计算的K线周期。")
+        dpg.add_text(f"   - 下单方式：市价单，或在买一/卖一只挂单（{maker_replace_seconds:g} 秒未成交重挂，{maker_deadline_seconds:g} 秒后剩余部分改市价）。")
+        dpg.add_text("   - 模拟运行：每轮只在状态栏显示合并后的订单计划和预估成本，不实际下单。")
         dpg.add_text("4) 点击 '保存设置' 确认参数(十分重要的步骤)")
         dpg.add_text("5) 点击 '启动交易' 开始自动化交易。")
         dpg.add_text("6) 点击 '停止交易' 暂停交易。")
@@ -463,6 +2575,8 @@ def show_help_window():
 
 # DearPyGui 界面
 def create_gui():
+    global dpg
+    import dearpygui.dearpygui as dpg
     dpg.create_context()
     icon_path = os.path.join(os.path.dirname(__file__), "jio.ico")
     if not os.path.exists(icon_path):
@@ -584,6 +2698,16 @@ def create_gui():
                     dpg.add_text("N/A", tag="balance_label")
                     dpg.bind_item_font(dpg.last_item(), body_font)
                     dpg.add_spacer()
+                with dpg.table_row():
+                    dpg.add_text("请求权重")
+                    dpg.add_text("N/A", tag="weight_label")
+                    dpg.bind_item_font(dpg.last_item(), body_font)
+                    dpg.add_spacer()
+                with dpg.table_row():
+                    dpg.add_text("挂单统计")
+                    dpg.add_text("N/A", tag="maker_label")
+                    dpg.bind_item_font(dpg.last_item(), body_font)
+                    dpg.add_spacer()
                 dpg.bind_item_theme(dpg.last_container(), table_theme)
 
             # 交易设置
@@ -609,6 +2733,12 @@ def create_gui():
                 with dpg.table_row():
                     dpg.add_text("K线周期")
                     dpg.add_combo(tag="kline_interval", items=['1m', '5m', '15m', '30m', '1h', '4h', '1d'], default_value='4h', width=220)
+                with dpg.table_row():
+                    dpg.add_text("下单方式")
+                    dpg.add_combo(tag="execution_mode", items=['市价单', '只挂单 (LIMIT_MAKER)'], default_value='市价单', width=220)
+                with dpg.table_row():
+                    dpg.add_text("模拟运行")
+                    dpg.add_checkbox(tag="dry_run", label="只生成订单计划，不下单", default_value=False)
                 dpg.bind_item_theme(dpg.last_container(), table_theme)
 
             # 操作按钮
@@ -637,13 +2767,165 @@ def create_gui():
         dpg.render_dearpygui_frame()
     dpg.destroy_context()
 
+# 无界面模式：状态栏消息写入日志，各标签的最新内容保存在内存中供状态查询
+status_values = {}
+
+def drain_updates():
+    while True:
+        tag, value, _ = update_queue.get()
+        if value is None:
+            continue
+        status_values[tag] = value
+        if tag == "status_label":
+            logging.info(value)
+
+# 当前运行状态
+def status_snapshot():
+    market = market_state
+    prices = {pair: market.prices.get(pair) for pair in selected_pairs}
+    mas = {pair: market.mas.get(pair) for pair in selected_pairs}
+    used, limit = request_budget.usage()
+    snapshot = {
+        'running': running,
+        'pairs': selected_pairs,
+        'prices': prices,
+        'ma': mas,
+        'weight': {'used': used, 'limit': limit, 'deferred': request_budget.deferred},
+        'status': status_values.get('status_label'),
+    }
+    # 多账户模式下余额、冷却和下单方式按账户分别给出，单账户模式直接给出主账户的
+    if accounts:
+        snapshot['accounts'] = {account.name: account.snapshot() for account in accounts}
+    else:
+        snapshot.update(primary_account.snapshot())
+    return snapshot
+
+# 本地状态查询：每个连接发送一行命令（status 或 stop），返回一行 JSON
+class StatusHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        command = self.rfile.readline().decode('utf-8', 'ignore').strip() or 'status'
+        if command == 'stop':
+            stop_trading()
+            reply = {'ok': True}
+        elif command == 'status':
+            reply = status_snapshot()
+        else:
+            reply = {'error': f"未知命令 {command}"}
+        self.wfile.write((json.dumps(reply, ensure_ascii=False, default=str) + "\n").encode('utf-8'))
+
+def status_server(address):
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.remove(address)
+        server = socketserver.ThreadingUnixStreamServer(address, StatusHandler)
+    else:
+        server = socketserver.ThreadingTCPServer(address, StatusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='status_server', daemon=True).start()
+    return server
+
+# 状态查询地址：配置中给出 status_socket（路径）或 status_port（本机端口），否则按平台选择默认值
+def status_address(config):
+    if config.get('status_port') or not hasattr(socket, 'AF_UNIX'):
+        return ('127.0.0.1', int(config.get('status_port') or STATUS_PORT))
+    return config.get('status_socket', STATUS_SOCKET)
+
+def query_status(config, command='status'):
+    address = status_address(config)
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as conn:
+        conn.connect(address)
+        conn.sendall(f"{command}\n".encode('utf-8'))
+        return conn.makefile('r', encoding='utf-8').readline()
+
+# 按配置设置日志（界面和无界面运行共用）：写入 log_file（默认 bot.log），按大小轮转；导入本模块时不配置日志
+def configure_logging(config):
+    handler = logging.handlers.RotatingFileHandler(config.get('log_file', 'bot.log'), maxBytes=LOG_MAX_BYTES,
+                                                   backupCount=LOG_BACKUPS, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+# 无界面运行：参数来自配置文件，日志按大小轮转写入磁盘，状态通过本地套接字查询，收到 SIGINT/SIGTERM 后停止交易并退出
+def run_headless(config_path):
+    global selected_pairs, running, client, price_bus_role
+    config = load_config(config_path)
+    configure_logging(config)
+    threading.Thread(target=drain_updates, name='status_log', daemon=True).start()
+    apply_settings(config)
+    if config.get('journal_file'):
+        primary_account.journal = OrderJournal(config['journal_file'])
+    price_bus_role = config.get('price_bus')
+    if price_bus_role == 'publish' and not (config.get('accounts') or config.get('api_key')):
+        # 只发布行情：行情接口不需要签名
+        client = WeightBudget(Spot(base_url=API_BASE_URL, show_limit_usage=True))
+        selected_pairs = validate_pairs(config.get('pairs') or selected_pairs)
+        members = []
+    elif config.get('accounts'):
+        # 多账户：accounts 中每项可单独配置密钥、交易对和交易设置
+        if not start_accounts(config['accounts']):
+            logging.error(f"{config_path} 中没有可用的账户")
+            return 1
+        members = accounts
+    else:
+        if not (config.get('api_key') and config.get('api_secret') and init_binance(config['api_key'], config['api_secret'])):
+            logging.error(f"{config_path} 中没有有效的 API 密钥")
+            return 1
+        update_balances(primary_account)
+        selected_pairs = validate_pairs(config.get('pairs') or selected_pairs)
+        members = [primary_account]
+    try:
+        for account in members:
+            account.journal.open()  # 另一个进程占用同一个订单日志时直接退出
+    except JournalLocked as e:
+        logging.error(str(e))
+        return 1
+    address = status_address(config)
+    server = status_server(address)
+    signal.signal(signal.SIGINT, lambda *_: stop_trading())
+    signal.signal(signal.SIGTERM, lambda *_: stop_trading())
+    logging.info(f"无界面模式启动，交易对 {selected_pairs}，账户 {[account.name for account in accounts] or 1}，状态查询 {address}")
+    running = True
+    trader = threading.Thread(target=trading_loop, args=(members,), name='trading', daemon=True)
+    trader.start()
+    while trader.is_alive():
+        trader.join(1)
+    server.shutdown()
+    server.server_close()
+    if price_bus:
+        price_bus.close()
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)
+    logging.info("无界面模式已退出")
+    return 0
+
 # 主函数
 def main():
+    global price_bus_role
+    parser = argparse.ArgumentParser(description='稳定币 MA 套利机器人')
+    parser.add_argument('--headless', action='store_true', help='不启动图形界面，按配置文件运行')
+    parser.add_argument('--config', default=CONFIG_FILE, help='配置文件（API 密钥、交易对和交易设置）')
+    parser.add_argument('--status', nargs='?', const='status', choices=['status', 'stop'],
+                        help='查询正在运行的无界面实例状态，或让其停止')
+    args = parser.parse_args()
+    if args.status:
+        print(query_status(load_config(args.config), args.status), end='')
+        return 0
+    if args.headless:
+        return run_headless(args.config)
     config = load_config()
+    configure_logging(config)
+    price_bus_role = config.get('price_bus')
+    if config.get('journal_file'):
+        primary_account.journal = OrderJournal(config['journal_file'])
     if config.get('api_key') and config.get('api_secret'):
         init_binance(config['api_key'], config['api_secret'])
-        update_balances()
+        update_balances(primary_account)
     create_gui()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
\ No newline at end of file